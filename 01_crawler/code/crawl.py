@@ -11,6 +11,7 @@ import logging
 import sys
 
 import crawling
+import dedup
 import reporting
 
 
@@ -33,9 +34,34 @@ ARGS.add_argument(
 ARGS.add_argument(
     '--max_tasks', action='store', type=int, metavar='N',
     default=100, help='Limit concurrent connections')
+ARGS.add_argument(
+    '--max_per_host', action='store', type=int, metavar='N',
+    help='Limit concurrent connections to each host')
+ARGS.add_argument(
+    '--crawl_delay', action='store', type=float, metavar='SECS',
+    default=0, help='Seconds between requests to the same host')
+ARGS.add_argument(
+    '--max_body', action='store', type=int, metavar='BYTES',
+    default=10 * 1024 * 1024, help='Limit bytes read from each response')
 ARGS.add_argument(
     '--exclude', action='store', metavar='REGEX',
     help='Exclude matching URLs')
+ARGS.add_argument(
+    '--state_dir', action='store', metavar='DIR',
+    help='Keep crawl state in DIR, and resume from it')
+ARGS.add_argument(
+    '--checkpoint_interval', action='store', type=float, metavar='SECS',
+    default=60, help='Seconds between saves of the crawl state')
+ARGS.add_argument(
+    '--dedup', action='store', choices=dedup.KINDS, default='set',
+    help='Keep URLs seen as strings, 64-bit fingerprints, or in a Bloom '
+    'filter')
+ARGS.add_argument(
+    '--bloom_error', action='store', type=float, metavar='RATE',
+    default=0.001, help='False positive rate of the Bloom filter')
+ARGS.add_argument(
+    '--status_interval', action='store', type=float, metavar='SECS',
+    default=0, help='Print progress to stderr every SECS seconds')
 ARGS.add_argument(
     '--strict', action='store_true',
     default=True, help='Strict host matching (default)')
@@ -88,13 +114,25 @@ def main():
                                max_redirect=args.max_redirect,
                                max_tries=args.max_tries,
                                max_tasks=args.max_tasks,
+                               state_dir=args.state_dir,
+                               checkpoint_interval=args.checkpoint_interval,
+                               max_per_host=args.max_per_host,
+                               crawl_delay=args.crawl_delay,
+                               max_body=args.max_body,
+                               dedup_kind=args.dedup,
+                               bloom_error=args.bloom_error,
                                )
+    if args.status_interval:
+        status = asyncio.Task(reporting.report_periodically(
+            crawler, args.status_interval, file=sys.stderr), loop=loop)
     try:
         loop.run_until_complete(crawler.crawl())  # Crawler gonna crawl.
     except KeyboardInterrupt:
         sys.stderr.flush()
         print('\nInterrupted\n')
     finally:
+        if args.status_interval:
+            status.cancel()
         reporting.report(crawler)
         crawler.close()
 
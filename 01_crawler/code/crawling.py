@@ -2,6 +2,7 @@
 
 import asyncio
 import cgi
+import codecs
 from collections import namedtuple
 import logging
 import re
@@ -17,8 +18,15 @@ except ImportError:
 
 import aiohttp  # Install with "pip install aiohttp".
 
+import dedup
+import frontier
+import scheduler
+
 LOGGER = logging.getLogger(__name__)
 
+# Bytes to read from a response at a time.
+CHUNK_SIZE = 64 * 1024
+
 
 def lenient_host(host):
     parts = host.split('.')[-2:]
@@ -29,6 +37,58 @@ def is_redirect(response):
     return response.status in (300, 301, 302, 303, 307)
 
 
+class LinkExtractor:
+    """Find the links in a document fed to it in chunks of bytes.
+
+    Links are matched in the raw bytes, so the document is never decoded or
+    held in memory as a whole; only the tail of a chunk that might be the
+    start of a link is kept for the next one.  This assumes an encoding
+    that is a superset of ASCII, as nearly all web pages use.
+
+    'links' is the set of distinct link targets, fragments removed, decoded
+    but not yet joined with the URL of the document.
+    """
+
+    # Replace href with (?:href|src) to follow image links.
+    pattern = re.compile(rb'''(?i)href=["']([^\s"'<>]+)''')
+    # Longest tail that can be the start of a match without being one.
+    prefix_size = len('href="')
+    # Longest link kept, so a runaway attribute can't take all the memory.
+    max_link_size = 8192
+
+    def __init__(self, encoding='utf-8'):
+        try:
+            self.encoding = codecs.lookup(encoding).name
+        except LookupError:
+            self.encoding = 'utf-8'
+        self.tail = b''
+        self.raw_links = set()
+
+    def feed(self, chunk):
+        data = self.tail + chunk
+        keep = max(0, len(data) - self.prefix_size)
+        for match in self.pattern.finditer(data):
+            if match.end() == len(data):
+                # The link may go on in the next chunk.
+                if match.end(1) - match.start(1) <= self.max_link_size:
+                    keep = match.start()
+                break
+            self.raw_links.add(match.group(1).partition(b'#')[0])
+            keep = max(keep, match.end())
+        self.tail = data[keep:]
+
+    def close(self):
+        """Take the links at the very end of the document."""
+        for match in self.pattern.finditer(self.tail):
+            self.raw_links.add(match.group(1).partition(b'#')[0])
+        self.tail = b''
+
+    @property
+    def links(self):
+        return {link.decode(self.encoding, 'replace')
+                for link in self.raw_links}
+
+
 FetchStatistic = namedtuple('FetchStatistic',
                             ['url',
                              'next_url',
@@ -38,7 +98,57 @@ FetchStatistic = namedtuple('FetchStatistic',
                              'content_type',
                              'encoding',
                              'num_urls',
-                             'num_new_urls'])
+                             'num_new_urls',
+                             'dns_time',
+                             'connect_time',
+                             'ttfb',
+                             'body_time'])
+# Seconds spent resolving the host, connecting (after resolving), until the
+# response headers arrived (from the start of the request), and reading the
+# body.  None when there was no such step, e.g. on a kept-alive connection.
+FetchStatistic.__new__.__defaults__ = (None, None, None, None)
+
+
+class TimingConnector(aiohttp.TCPConnector):
+    """A TCPConnector that times host lookups and connecting.
+
+    Timings are kept for the task that made the connection, until it calls
+    pop_timings().  This overrides methods private to aiohttp, since it has
+    no public hooks for them, so it needs the aiohttp before 2.0 (see
+    requirements.txt).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timings = {}
+
+    def _record(self, name, t0):
+        task = asyncio.Task.current_task(loop=self._loop)
+        self.timings.setdefault(task, {})[name] = self._loop.time() - t0
+
+    @asyncio.coroutine
+    def _resolve_host(self, host, port):
+        t0 = self._loop.time()
+        try:
+            return (yield from super()._resolve_host(host, port))
+        finally:
+            self._record('dns_time', t0)
+
+    @asyncio.coroutine
+    def _create_connection(self, req):
+        t0 = self._loop.time()
+        try:
+            return (yield from super()._create_connection(req))
+        finally:
+            self._record('connect_time', t0)
+
+    def pop_timings(self):
+        """Return and forget the dns_time and connect_time of this task."""
+        task = asyncio.Task.current_task(loop=self._loop)
+        timings = self.timings.pop(task, {})
+        if 'connect_time' in timings:
+            timings['connect_time'] -= timings.get('dns_time', 0)
+        return timings
 
 
 class Crawler:
@@ -46,11 +156,33 @@ class Crawler:
 
     This manages two sets of URLs: 'urls' and 'done'.  'urls' is a set of
     URLs seen, and 'done' is a list of FetchStatistics.
+
+    At most max_body bytes are read from each response; links in the rest
+    of a longer document are not followed.
+
+    If state_dir is given, the queue and the URLs seen are kept on disk
+    there instead (see frontier.CrawlState), and checkpointed every
+    checkpoint_interval seconds.  A crawl with the same state_dir resumes
+    from the last checkpoint.
+
+    The URLs seen are kept as strings, or with dedup_kind='fingerprint'
+    as 64-bit fingerprints in a compact hash table, or with
+    dedup_kind='bloom' in a scalable Bloom filter that wrongly takes about
+    bloom_error of new URLs for seen ones (see dedup.py).
+
+    URLs are handed to the workers host by host (see
+    scheduler.HostScheduler), with at most max_per_host fetches and
+    connections per host, and crawl_delay seconds between the starts of
+    fetches from the same host.
     """
     def __init__(self, roots,
                  exclude=None, strict=True,  # What to crawl.
                  max_redirect=10, max_tries=4,  # Per-url limits.
-                 max_tasks=10, *, loop=None):
+                 max_tasks=10, *, loop=None,
+                 state_dir=None, checkpoint_interval=60,
+                 max_per_host=None, crawl_delay=0,
+                 max_body=10 * 1024 * 1024,
+                 dedup_kind='set', bloom_error=0.001):
         self.loop = loop or asyncio.get_event_loop()
         self.roots = roots
         self.exclude = exclude
@@ -58,10 +190,37 @@ class Crawler:
         self.max_redirect = max_redirect
         self.max_tries = max_tries
         self.max_tasks = max_tasks
-        self.q = Queue(loop=self.loop)
-        self.seen_urls = set()
+        self.checkpoint_interval = checkpoint_interval
+        self.max_per_host = max_per_host
+        self.crawl_delay = crawl_delay
+        self.max_body = max_body
+        self.dedup_kind = dedup_kind
+        self.state = None
+        if state_dir:
+            self.state = frontier.CrawlState(
+                state_dir, loop=self.loop,
+                fingerprints=dedup.make_fingerprints(dedup_kind, bloom_error))
+            self.frontier = self.state.q
+            self.seen_urls = self.state.seen_urls
+        else:
+            self.frontier = Queue(loop=self.loop)
+            if dedup_kind == 'set':
+                self.seen_urls = set()
+            else:
+                self.seen_urls = dedup.URLSet(
+                    dedup.make_fingerprints(dedup_kind, bloom_error))
+        self.q = scheduler.HostScheduler(self.frontier,
+                                         max_per_host=max_per_host,
+                                         crawl_delay=crawl_delay,
+                                         loop=self.loop)
+        self.in_flight = {}  # Maps URLs being fetched to their max_redirect.
         self.done = []
-        self.session = aiohttp.ClientSession(loop=self.loop)
+        # In the aiohttp this needs (see requirements.txt), limit is the
+        # number of connections (in use or kept alive) to each host, not in
+        # total.
+        self.connector = TimingConnector(limit=max_per_host, loop=self.loop)
+        self.session = aiohttp.ClientSession(connector=self.connector,
+                                             loop=self.loop)
         self.root_domains = set()
         for root in roots:
             parts = urllib.parse.urlparse(root)
@@ -76,14 +235,43 @@ class Crawler:
                     self.root_domains.add(host)
                 else:
                     self.root_domains.add(lenient_host(host))
+        if self.state:
+            # Fetch again whatever was being fetched at the last checkpoint.
+            for url, max_redirect in self.state.in_flight:
+                self.q.put_nowait((url, max_redirect))
         for root in roots:
-            self.add_url(root)
+            if root not in self.seen_urls:
+                self.add_url(root)
         self.t0 = time.time()
         self.t1 = None
 
     def close(self):
         """Close resources."""
         self.session.close()
+        if self.state:
+            self.checkpoint()
+            self.state.close()
+            self.state = None
+
+    def checkpoint(self):
+        """Save the crawl state, if it's kept on disk."""
+        if self.state:
+            # URLs waiting in the per-host queues have left the frontier,
+            # so they're saved with the ones being fetched.
+            self.state.checkpoint(list(self.in_flight.items()) +
+                                  self.q.items())
+            LOGGER.info('checkpoint with %r urls to do', self.q.qsize())
+
+    @asyncio.coroutine
+    def checkpoint_periodically(self):
+        """Checkpoint the crawl state every checkpoint_interval seconds."""
+        try:
+            while True:
+                yield from asyncio.sleep(self.checkpoint_interval,
+                                         loop=self.loop)
+                self.checkpoint()
+        except asyncio.CancelledError:
+            pass
 
     def host_okay(self, host):
         """Check if a host should be crawled.
@@ -127,7 +315,7 @@ class Crawler:
         links = set()
         content_type = None
         encoding = None
-        body = yield from response.read()
+        extractor = None
 
         if response.status == 200:
             content_type = response.headers.get('content-type')
@@ -138,30 +326,49 @@ class Crawler:
 
             encoding = pdict.get('charset', 'utf-8')
             if content_type in ('text/html', 'application/xml'):
-                text = yield from response.text()
-
-                # Replace href with (?:href|src) to follow image links.
-                urls = set(re.findall(r'''(?i)href=["']([^\s"'<>]+)''',
-                                      text))
-                if urls:
-                    LOGGER.info('got %r distinct urls from %r',
-                                len(urls), response.url)
-                for url in urls:
-                    normalized = urllib.parse.urljoin(response.url, url)
-                    defragmented, frag = urllib.parse.urldefrag(normalized)
-                    if self.url_allowed(defragmented):
-                        links.add(defragmented)
+                extractor = LinkExtractor(encoding)
+
+        size = 0
+        t0 = self.loop.time()
+        while size < self.max_body:
+            chunk = yield from response.content.read(
+                min(CHUNK_SIZE, self.max_body - size))
+            if not chunk:
+                break
+            size += len(chunk)
+            if extractor:
+                extractor.feed(chunk)
+        else:
+            if not response.content.at_eof():
+                LOGGER.warning('%r is longer than %r bytes, truncated',
+                               response.url, self.max_body)
+                # Drop the connection instead of reading the rest.
+                response.close()
+        body_time = self.loop.time() - t0
+
+        if extractor:
+            extractor.close()
+            urls = extractor.links
+            if urls:
+                LOGGER.info('got %r distinct urls from %r',
+                            len(urls), response.url)
+            for url in urls:
+                normalized = urllib.parse.urljoin(response.url, url)
+                if self.url_allowed(normalized):
+                    links.add(normalized)
 
         stat = FetchStatistic(
             url=response.url,
             next_url=None,
             status=response.status,
             exception=None,
-            size=len(body),
+            size=size,
             content_type=content_type,
             encoding=encoding,
             num_urls=len(links),
-            num_new_urls=len(links - self.seen_urls))
+            num_new_urls=sum(1 for link in links
+                             if link not in self.seen_urls),
+            body_time=body_time)
 
         return stat, links
 
@@ -171,9 +378,13 @@ class Crawler:
         tries = 0
         exception = None
         while tries < self.max_tries:
+            self.connector.pop_timings()  # Forget any earlier try.
+            t0 = self.loop.time()
             try:
                 response = yield from self.session.get(
                     url, allow_redirects=False)
+                timings = self.connector.pop_timings()
+                timings['ttfb'] = self.loop.time() - t0
 
                 if tries > 1:
                     LOGGER.info('try %r for %r success', tries, url)
@@ -211,7 +422,8 @@ class Crawler:
                                                      content_type=None,
                                                      encoding=None,
                                                      num_urls=0,
-                                                     num_new_urls=0))
+                                                     num_new_urls=0,
+                                                     **timings))
 
                 if next_url in self.seen_urls:
                     return
@@ -223,9 +435,10 @@ class Crawler:
                                  next_url, url)
             else:
                 stat, links = yield from self.parse_links(response)
-                self.record_statistic(stat)
-                for link in links.difference(self.seen_urls):
-                    self.q.put_nowait((link, self.max_redirect))
+                self.record_statistic(stat._replace(**timings))
+                for link in links:
+                    if link not in self.seen_urls:
+                        self.q.put_nowait((link, self.max_redirect))
                 self.seen_urls.update(links)
         finally:
             yield from response.release()
@@ -237,7 +450,10 @@ class Crawler:
             while True:
                 url, max_redirect = yield from self.q.get()
                 assert url in self.seen_urls
+                self.in_flight[url] = max_redirect
                 yield from self.fetch(url, max_redirect)
+                del self.in_flight[url]
+                self.q.release(url)
                 self.q.task_done()
         except asyncio.CancelledError:
             pass
@@ -268,6 +484,9 @@ class Crawler:
         """Run the crawler until all finished."""
         workers = [asyncio.Task(self.work(), loop=self.loop)
                    for _ in range(self.max_tasks)]
+        if self.state:
+            workers.append(asyncio.Task(self.checkpoint_periodically(),
+                                        loop=self.loop))
         self.t0 = time.time()
         yield from self.q.join()
         self.t1 = time.time()
@@ -0,0 +1,197 @@
+"""A simple web crawler -- compact sets of the URLs seen."""
+
+import array
+import math
+import sys
+
+import frontier
+
+KINDS = ('set', 'fingerprint', 'bloom')
+
+
+class FingerprintSet:
+    """A set of 64-bit fingerprints, in one array of unsigned integers.
+
+    This is a hash table with open addressing: each fingerprint takes 8
+    bytes, plus the free slots that keep the table at most 2/3 full, so 12
+    to 24 bytes, where a Python set of ints takes several times that.  The
+    fingerprints are hashes already, so their low bits pick the slot.
+    """
+
+    def __init__(self, capacity=1024):
+        size = 8
+        while size * 2 < capacity * 3:
+            size *= 2
+        self.table = array.array('Q', bytes(8 * size))
+        self.mask = size - 1
+        self.length = 0
+
+    def _slot(self, value):
+        """Return the slot of value, or of the free slot it would go in."""
+        table = self.table
+        i = value & self.mask
+        while table[i] and table[i] != value:
+            i = (i + 1) & self.mask
+        return i
+
+    def __contains__(self, value):
+        # Zero marks free slots, so it's stored as one.
+        value = value or 1
+        return self.table[self._slot(value)] == value
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return (value for value in self.table if value)
+
+    def add(self, value):
+        value = value or 1
+        i = self._slot(value)
+        if self.table[i] != value:
+            self.table[i] = value
+            self.length += 1
+            if self.length * 3 > len(self.table) * 2:
+                self._grow()
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def _grow(self):
+        old = self.table
+        self.table = array.array('Q', bytes(16 * len(old)))
+        self.mask = len(self.table) - 1
+        for value in old:
+            if value:
+                self.table[self._slot(value)] = value
+
+    def memory_size(self):
+        return sys.getsizeof(self.table)
+
+
+class BloomFilter:
+    """A Bloom filter of 64-bit fingerprints, for a given capacity and
+    false positive rate.
+
+    The bit positions are derived from the fingerprint by double hashing,
+    so adding or testing a value computes no hashes of its own.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.num_hashes = math.ceil(-math.log2(error_rate))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.length = 0
+
+    def _positions(self, value):
+        h1 = value & 0xffffffff
+        h2 = (value >> 32) | 1
+        return ((h1 + i * h2) % self.num_bits
+                for i in range(self.num_hashes))
+
+    def __contains__(self, value):
+        bits = self.bits
+        return all(bits[i >> 3] & (1 << (i & 7))
+                   for i in self._positions(value))
+
+    def __len__(self):
+        return self.length
+
+    def add(self, value):
+        bits = self.bits
+        found = True
+        for i in self._positions(value):
+            mask = 1 << (i & 7)
+            if not bits[i >> 3] & mask:
+                bits[i >> 3] |= mask
+                found = False
+        if not found:
+            self.length += 1
+
+    def memory_size(self):
+        return sys.getsizeof(self.bits)
+
+
+class ScalableBloomFilter:
+    """A Bloom filter that grows to hold any number of values.
+
+    When a filter is full, a new one twice its size, with half its false
+    positive rate, is added; the rates form a series that adds up to at
+    most error_rate.  len() counts the values added, less those that were
+    taken for false positives.
+    """
+
+    growth = 2
+    tightening = 0.5
+
+    def __init__(self, error_rate=0.001, capacity=100000):
+        self.error_rate = error_rate
+        self.filters = [BloomFilter(capacity,
+                                    error_rate * (1 - self.tightening))]
+
+    def __contains__(self, value):
+        return any(value in f for f in reversed(self.filters))
+
+    def __len__(self):
+        return sum(len(f) for f in self.filters)
+
+    def add(self, value):
+        if value in self:
+            return
+        last = self.filters[-1]
+        if len(last) >= last.capacity:
+            last = BloomFilter(last.capacity * self.growth,
+                               last.error_rate * self.tightening)
+            self.filters.append(last)
+        last.add(value)
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def memory_size(self):
+        return sum(f.memory_size() for f in self.filters)
+
+
+def make_fingerprints(kind, error_rate=0.001):
+    """Return an empty container of fingerprints of the given kind."""
+    if kind == 'fingerprint':
+        return FingerprintSet()
+    if kind == 'bloom':
+        return ScalableBloomFilter(error_rate)
+    return set()
+
+
+class URLSet:
+    """A set of URLs, stored as fingerprints in a container of ints.
+
+    Supports 'in', add(), update() and len() like a set of URLs.
+    """
+
+    def __init__(self, fingerprints):
+        self.fingerprints = fingerprints
+
+    def __contains__(self, url):
+        return frontier.fingerprint(url) in self.fingerprints
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def add(self, url):
+        self.fingerprints.add(frontier.fingerprint(url))
+
+    def update(self, urls):
+        for url in urls:
+            self.add(url)
+
+
+def memory_size(urls):
+    """Return about how many bytes a set of URLs takes."""
+    urls = getattr(urls, 'fingerprints', urls)
+    if hasattr(urls, 'memory_size'):
+        return urls.memory_size()
+    return sys.getsizeof(urls) + sum(sys.getsizeof(url) for url in urls)
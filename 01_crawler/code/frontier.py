@@ -0,0 +1,235 @@
+"""A simple web crawler -- crawl state kept on disk, to survive restarts."""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import struct
+
+try:
+    # Python 3.4.
+    from asyncio import JoinableQueue as Queue
+except ImportError:
+    # Python 3.5.
+    from asyncio import Queue
+
+LOGGER = logging.getLogger(__name__)
+
+# Number of queue items in each segment file.
+SEGMENT_SIZE = 10000
+
+FINGERPRINT = struct.Struct('>Q')
+
+
+def fingerprint(url):
+    """Return a 64-bit fingerprint of a URL."""
+    digest = hashlib.sha1(url.encode('utf-8', 'surrogateescape')).digest()
+    return FINGERPRINT.unpack(digest[:FINGERPRINT.size])[0]
+
+
+class SeenLog:
+    """A set of URLs, stored as fingerprints and logged to a file.
+
+    Supports 'in', add() and len() like the set of URLs the crawler uses
+    otherwise.  A fingerprint takes far less memory than its URL.  The
+    fingerprints are kept in a set, or in the set-like container given
+    (see dedup.make_fingerprints).
+    """
+
+    def __init__(self, filename, size=0, fingerprints=None):
+        self.fingerprints = set() if fingerprints is None else fingerprints
+        self.file = open(filename, 'a+b')
+        # Drop anything written after the checkpoint we resume from.
+        self.file.truncate(size)
+        self.file.seek(0)
+        data = self.file.read(size)
+        for offset in range(0, len(data), FINGERPRINT.size):
+            self.fingerprints.add(FINGERPRINT.unpack_from(data, offset)[0])
+        self.file.seek(size)
+
+    def __contains__(self, url):
+        return fingerprint(url) in self.fingerprints
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def add(self, url):
+        value = fingerprint(url)
+        if value not in self.fingerprints:
+            self.fingerprints.add(value)
+            self.file.write(FINGERPRINT.pack(value))
+
+    def update(self, urls):
+        for url in urls:
+            self.add(url)
+
+    def sync(self):
+        """Write everything to disk, and return the size of the log."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class SegmentLog:
+    """A FIFO of (url, max_redirect) items, in numbered segment files.
+
+    Items are appended to the newest segment and read from the oldest, so
+    only the unread part of the oldest segment is held in memory.  Segments
+    that have been read are deleted at the next checkpoint.
+
+    This has the deque methods asyncio.Queue uses, so it can replace the
+    deque inside one (see DiskQueue).
+    """
+
+    def __init__(self, directory, state=None, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.head = collections.deque()
+        if state is None:
+            # Start afresh, without whatever an earlier crawl left behind.
+            for name in os.listdir(directory):
+                if name.startswith('segment-'):
+                    os.remove(os.path.join(directory, name))
+            state = {'read_segment': 0, 'read_offset': 0,
+                     'write_segment': 0, 'write_size': 0, 'length': 0}
+        self.read_segment = state['read_segment']
+        self.read_offset = state['read_offset']
+        self.write_segment = state['write_segment']
+        self.length = state['length']
+
+        self.file = open(self._filename(self.write_segment), 'a+')
+        self.file.truncate(state['write_size'])
+        self.file.seek(0)
+        self.write_count = sum(1 for _ in self.file)
+        self.file.seek(state['write_size'])
+        self._load_head()
+
+    def _filename(self, segment):
+        return os.path.join(self.directory, 'segment-%d' % segment)
+
+    def _load_head(self):
+        """Read the unread items of the oldest segment into memory."""
+        if self.read_segment == self.write_segment:
+            self.file.flush()
+        with open(self._filename(self.read_segment)) as f:
+            lines = f.readlines()
+        self.head = collections.deque(
+            tuple(json.loads(line)) for line in lines[self.read_offset:])
+
+    def __len__(self):
+        return self.length
+
+    def append(self, item):
+        self.file.write(json.dumps(item) + '\n')
+        self.write_count += 1
+        self.length += 1
+        if self.read_segment == self.write_segment:
+            self.head.append(item)
+        if self.write_count >= self.segment_size:
+            self.file.close()
+            self.write_segment += 1
+            self.write_count = 0
+            self.file = open(self._filename(self.write_segment), 'a+')
+
+    def popleft(self):
+        if not self.head:
+            if self.read_segment == self.write_segment:
+                raise IndexError('pop from an empty SegmentLog')
+            self.read_segment += 1
+            self.read_offset = 0
+            self._load_head()
+        self.read_offset += 1
+        self.length -= 1
+        return self.head.popleft()
+
+    def sync(self):
+        """Write everything to disk, and return the state to resume from."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {'read_segment': self.read_segment,
+                'read_offset': self.read_offset,
+                'write_segment': self.write_segment,
+                'write_size': self.file.tell(),
+                'length': self.length}
+
+    def remove_read_segments(self):
+        """Delete the segments before the one being read."""
+        segment = self.read_segment - 1
+        while segment >= 0 and os.path.exists(self._filename(segment)):
+            os.remove(self._filename(segment))
+            segment -= 1
+
+    def close(self):
+        self.file.close()
+
+
+class DiskQueue(Queue):
+    """An asyncio queue whose items are kept in a SegmentLog."""
+
+    def __init__(self, log, *, loop=None):
+        self.log = log
+        super().__init__(loop=loop)
+        # Items recovered from disk are unfinished, as if they'd just been put.
+        if self.log:
+            self._unfinished_tasks += len(self.log)
+            self._finished.clear()
+
+    def _init(self, maxsize):
+        self._queue = self.log
+
+
+class CrawlState:
+    """The crawl frontier and seen URLs of a crawl, kept in a directory.
+
+    checkpoint() records a consistent state to resume from: the position in
+    the frontier, the size of the seen log, and the URLs being fetched, which
+    will be fetched again.  Anything done after the last checkpoint is
+    forgotten when resuming.
+    """
+
+    def __init__(self, directory, *, loop=None, segment_size=SEGMENT_SIZE,
+                 fingerprints=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.checkpoint_file = os.path.join(directory, 'checkpoint.json')
+        try:
+            with open(self.checkpoint_file) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = None
+        self.resumed = state is not None
+
+        self.seen_urls = SeenLog(os.path.join(directory, 'seen'),
+                                 state['seen_size'] if state else 0,
+                                 fingerprints)
+        self.q = DiskQueue(SegmentLog(directory,
+                                      state['frontier'] if state else None,
+                                      segment_size),
+                           loop=loop)
+        self.in_flight = [tuple(item) for item in state['in_flight']] \
+            if state else []
+        if self.resumed:
+            LOGGER.info('resuming with %r urls seen, %r to do',
+                        len(self.seen_urls),
+                        self.q.qsize() + len(self.in_flight))
+
+    def checkpoint(self, in_flight):
+        """Save the state, with the (url, max_redirect) items in_flight."""
+        state = {'seen_size': self.seen_urls.sync(),
+                 'frontier': self.q.log.sync(),
+                 'in_flight': list(in_flight)}
+        temp_file = self.checkpoint_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.checkpoint_file)
+        self.q.log.remove_read_segments()
+
+    def close(self):
+        self.seen_urls.close()
+        self.q.log.close()
@@ -1,6 +1,10 @@
 """Reporting subsystem for web crawler."""
 
+import asyncio
 import time
+import urllib.parse
+
+import dedup
 
 
 class Stats:
@@ -40,6 +44,8 @@ def report(crawler, file=None):
           '(%.3f urls/sec/task)' % speed,
           file=file)
     stats.report(file=file)
+    latency_report(crawler, file=file)
+    seen_report(crawler, file=file)
     print('Todo:', crawler.q.qsize(), file=file)
     print('Done:', len(crawler.done), file=file)
     print('Date:', time.ctime(), 'local time', file=file)
@@ -78,3 +84,90 @@ def url_report(stat, stats, file=None):
               stat.content_type, stat.encoding,
               stat.size,
               file=file)
+
+
+def seen_report(crawler, file=None):
+    """Print how many URLs were seen, and the memory they take."""
+    num_urls = len(crawler.seen_urls)
+    size = dedup.memory_size(crawler.seen_urls)
+    print('Seen:', num_urls, 'urls in %d bytes' % size,
+          '(%.1f bytes/url, dedup=%s)' % (size / max(num_urls, 1),
+                                         crawler.dedup_kind),
+          file=file)
+
+
+def percentile(values, fraction):
+    """Return the value at fraction of the way through sorted values."""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def mean(values):
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) if values else 0
+
+
+def latency_report(crawler, file=None):
+    """Print percentiles of the time to fetch a URL, per host.
+
+    The time is from the start of the request to the end of the body; the
+    mean of each step of it is printed too.
+    """
+    by_host = {}
+    for stat in crawler.done:
+        if stat.ttfb is not None:
+            host = urllib.parse.urlparse(stat.url).netloc
+            by_host.setdefault(host, []).append(stat)
+    if not by_host:
+        return
+    print('Latency (secs):    p50    p90    p99    max'
+          '    dns connect   ttfb   body', file=file)
+    for host, host_stats in sorted(by_host.items()):
+        times = sorted(stat.ttfb + (stat.body_time or 0)
+                       for stat in host_stats)
+        means = [mean([getattr(stat, name) for stat in host_stats])
+                 for name in ('dns_time', 'connect_time', 'ttfb', 'body_time')]
+        print('%10d     ' % len(times),
+              ' '.join('%6.3f' % percentile(times, fraction)
+                       for fraction in (0.5, 0.9, 0.99)),
+              '%6.3f' % times[-1],
+              ' '.join('%6.3f' % value for value in means),
+              host, file=file)
+
+
+class LiveStats:
+    """Sample the progress of a crawl as it goes."""
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.last_time = time.time()
+        self.last_done = 0
+
+    def sample(self):
+        """Return the pages/sec and bytes/sec since the last sample."""
+        now = time.time()
+        done = self.crawler.done[self.last_done:]
+        dt = max(now - self.last_time, 1e-6)
+        self.last_time = now
+        self.last_done += len(done)
+        return len(done) / dt, sum(stat.size for stat in done) / dt
+
+    def report(self, file=None):
+        pages_per_sec, bytes_per_sec = self.sample()
+        print('%.1f pages/sec' % pages_per_sec,
+              '%.0f bytes/sec' % bytes_per_sec,
+              'todo %d' % self.crawler.q.qsize(),
+              'fetching %d' % len(self.crawler.in_flight),
+              'done %d' % len(self.crawler.done),
+              file=file, flush=True)
+
+
+@asyncio.coroutine
+def report_periodically(crawler, interval, file=None):
+    """Print the progress of a crawl every interval seconds."""
+    live = LiveStats(crawler)
+    try:
+        while True:
+            yield from asyncio.sleep(interval, loop=crawler.loop)
+            live.report(file=file)
+    except asyncio.CancelledError:
+        pass
@@ -0,0 +1,144 @@
+"""A simple web crawler -- per-host scheduling of the URLs to fetch."""
+
+import asyncio
+import collections
+import urllib.parse
+
+# Most URLs to hold in each host's queue, waiting for the host to be ready.
+MAX_BUFFERED_PER_HOST = 100
+
+
+def url_host(url):
+    """Return the host (and port) a URL is fetched from."""
+    return urllib.parse.urlparse(url).netloc.lower()
+
+
+class HostScheduler:
+    """Hand out the URLs in a queue host by host, politely.
+
+    URLs are taken from the frontier, an asyncio queue of (url, max_redirect)
+    items, and sorted into one queue per host.  get() returns an item from
+    the next host, round robin, that is ready: it has fewer than max_per_host
+    fetches in progress, and its last fetch started at least crawl_delay
+    seconds ago.  release(url) must be called when a fetch is finished.
+
+    Each host's queue holds at most max_buffered_per_host URLs; the rest
+    wait in order in the host's backlog, and move up as its queue empties.
+    So one busy or slow host can't keep the others waiting, and no URL goes
+    through the frontier twice.
+
+    Otherwise this works like the frontier: items are put with put_nowait(),
+    marked done with task_done(), and join() waits for them all.
+    """
+
+    def __init__(self, frontier, *, max_per_host=None, crawl_delay=0,
+                 max_buffered_per_host=MAX_BUFFERED_PER_HOST, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.frontier = frontier
+        self.max_per_host = max_per_host
+        self.crawl_delay = crawl_delay
+        self.max_buffered_per_host = max_buffered_per_host
+        self.hosts = collections.OrderedDict()  # Host -> deque of items.
+        self.backlog = {}  # Host -> deque of items its queue had no room for.
+        self.active = collections.Counter()  # Host -> fetches in progress.
+        self.next_start = {}  # Host -> time its next fetch may start.
+        self.buffered = 0
+        self.changed = asyncio.Event(loop=self.loop)
+
+    def put_nowait(self, item):
+        self.frontier.put_nowait(item)
+        self.changed.set()
+
+    def task_done(self):
+        self.frontier.task_done()
+
+    @asyncio.coroutine
+    def join(self):
+        yield from self.frontier.join()
+
+    def qsize(self):
+        return self.frontier.qsize() + self.buffered
+
+    def items(self):
+        """Return the items taken from the frontier but not handed out."""
+        return ([item for queue in self.hosts.values() for item in queue] +
+                [item for queue in self.backlog.values() for item in queue])
+
+    @asyncio.coroutine
+    def get(self):
+        """Remove and return an item from the next ready host."""
+        while True:
+            self._take()
+            item = self._get_ready()
+            if item is not None:
+                return item
+            yield from self._wait()
+
+    def release(self, url):
+        """Record that the fetch of url is finished."""
+        host = url_host(url)
+        self.active[host] -= 1
+        if not self.active[host]:
+            del self.active[host]
+        self.changed.set()
+
+    def _take(self):
+        """Move the URLs in the frontier to their hosts' queues or backlogs."""
+        while not self.frontier.empty():
+            item = self.frontier.get_nowait()
+            host = url_host(item[0])
+            queue = self.hosts.get(host)
+            if queue is None:
+                queue = self.hosts[host] = collections.deque()
+            if len(queue) < self.max_buffered_per_host:
+                queue.append(item)
+            else:
+                self.backlog.setdefault(host, collections.deque()).append(item)
+            self.buffered += 1
+
+    def _ready(self, host, now):
+        if self.max_per_host and self.active[host] >= self.max_per_host:
+            return False
+        return self.next_start.get(host, 0) <= now
+
+    def _get_ready(self):
+        now = self.loop.time()
+        for host, queue in self.hosts.items():
+            if self._ready(host, now):
+                break
+        else:
+            return None
+        item = queue.popleft()
+        self.buffered -= 1
+        backlog = self.backlog.get(host)
+        if backlog:
+            queue.append(backlog.popleft())
+            if not backlog:
+                del self.backlog[host]
+        if queue:
+            # Go to the back of the line.
+            self.hosts.move_to_end(host)
+        else:
+            del self.hosts[host]
+        self.active[host] += 1
+        if self.crawl_delay:
+            self.next_start[host] = now + self.crawl_delay
+        elif host in self.next_start:
+            del self.next_start[host]
+        return item
+
+    @asyncio.coroutine
+    def _wait(self):
+        """Wait until a host might have become ready, or URLs are added."""
+        self.changed.clear()
+        now = self.loop.time()
+        delays = [self.next_start[host] - now for host in self.hosts
+                  if host in self.next_start and
+                  not (self.max_per_host and
+                       self.active[host] >= self.max_per_host)]
+        timeout = max(0, min(delays)) if delays else None
+        try:
+            yield from asyncio.wait_for(self.changed.wait(), timeout,
+                                        loop=self.loop)
+        except asyncio.TimeoutError:
+            pass
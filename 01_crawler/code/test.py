@@ -2,12 +2,19 @@ import asyncio
 from contextlib import contextmanager
 import io
 import logging
+import os
+import shutil
 import socket
+import tempfile
 import unittest
 
 from aiohttp import ClientError, web
 
 import crawling
+import dedup
+import frontier
+import reporting
+import scheduler
 
 
 @contextmanager
@@ -147,6 +154,22 @@ class TestCrawler(unittest.TestCase):
                         num_urls=1,
                         num_new_urls=0)
 
+    def test_dedup_kinds(self):
+        url = self.add_page('/foo', ['/bar'])
+        self.add_page('/bar', ['/foo'])
+        for dedup_kind in dedup.KINDS:
+            self.crawl([url], dedup_kind=dedup_kind)
+            self.assertDoneCount(2)
+            self.assertStat(1, num_urls=1, num_new_urls=0)
+            self.assertIn(url, self.crawler.seen_urls)
+
+            state_dir = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, state_dir)
+            self.crawl([url], dedup_kind=dedup_kind, state_dir=state_dir)
+            self.assertDoneCount(2)
+            self.crawl([url], dedup_kind=dedup_kind, state_dir=state_dir)
+            self.assertDoneCount(0)
+
     def test_prohibited_host(self):
         # Link to example.com.
         self.add_page('/', ['http://example.com'])
@@ -267,6 +290,43 @@ class TestCrawler(unittest.TestCase):
         self.assertEqual(2, max_tasks)
         self.assertDoneCount(4)
 
+    def test_max_per_host(self):
+        n_tasks = 0
+        max_tasks = 0
+
+        @asyncio.coroutine
+        def handler(_):
+            nonlocal n_tasks, max_tasks
+            n_tasks += 1
+            max_tasks = max(n_tasks, max_tasks)
+            yield from asyncio.sleep(0.01, loop=self.loop)
+            n_tasks -= 1
+            return web.Response(body=b'')
+
+        urls = ['/0', '/1', '/2']
+        for url in urls:
+            self.add_handler(url, handler)
+        home = self.add_page('/', urls)
+        self.crawl([home], max_tasks=3, max_per_host=1)
+        self.assertEqual(1, max_tasks)
+        self.assertDoneCount(4)
+
+    def test_crawl_delay(self):
+        starts = []
+
+        @asyncio.coroutine
+        def handler(_):
+            starts.append(self.loop.time())
+            return web.Response(body=b'')
+
+        urls = ['/0', '/1']
+        for url in urls:
+            self.add_handler(url, handler)
+        home = self.add_page('/', urls)
+        self.crawl([home], crawl_delay=0.05)
+        self.assertDoneCount(3)
+        self.assertGreaterEqual(starts[1] - starts[0], 0.04)
+
     def test_max_tries(self):
         n_tries = 0
 
@@ -328,12 +388,214 @@ class TestCrawler(unittest.TestCase):
         self.crawl([self.app_url + '/image'])
         self.assertStat(content_type='image', num_urls=0)
 
+    def test_max_body(self):
+        body = ('<a href="/foo">' + ' ' * 1000 + '<a href="/bar">').encode()
+        self.add_page(body=body)
+        self.add_page('/foo')
+        with capture_logging() as messages:
+            self.crawl(max_body=500)
+        self.assertStat(0, url=self.app_url + '/', size=500, num_urls=1)
+        self.assertStat(1, url=self.app_url + '/foo')
+        self.assertDoneCount(2)
+        self.assertIn('truncated', messages)
+
+    def test_timings(self):
+        self.add_page(body=b'x' * 1000)
+        self.crawl()
+        stat = self.crawler.done[0]
+        self.assertGreaterEqual(stat.ttfb, 0)
+        self.assertGreaterEqual(stat.body_time, 0)
+
+    def test_report(self):
+        self.add_page('/', ['/foo'])
+        self.add_page('/foo')
+        self.crawl()
+        live = reporting.LiveStats(self.crawler)
+        pages_per_sec, bytes_per_sec = live.sample()
+        self.assertGreater(pages_per_sec, 0)
+        self.assertEqual(live.sample(), (0, 0))
+
+        f = io.StringIO()
+        reporting.report(self.crawler, file=f)
+        output = f.getvalue()
+        self.assertIn('Latency', output)
+        self.assertIn('127.0.0.1:{}'.format(self.port), output)
+        self.assertIn('Seen: 2 urls', output)
+
     def test_non_http(self):
         body = '<a href="ftp://example.com">'.encode('utf-8')
         self.add_page(body=body)
         self.crawl()
         self.assertStat(num_urls=0)
 
+    def test_resume(self):
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+        self.add_page('/', ['/foo'])
+        self.add_page('/foo', ['/'])
+        self.crawl(state_dir=state_dir)
+        self.assertDoneCount(2)
+
+        # Everything has been seen, so the same crawl has nothing left to do.
+        self.crawl(state_dir=state_dir)
+        self.assertDoneCount(0)
+
+
+class TestCrawlState(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+        self.addCleanup(self.loop.close)
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.state_dir)
+
+    def open_state(self):
+        state = frontier.CrawlState(self.state_dir, loop=self.loop,
+                                    segment_size=2)
+        self.addCleanup(state.close)
+        return state
+
+    def test_resume_from_checkpoint(self):
+        state = self.open_state()
+        self.assertFalse(state.resumed)
+        urls = ['http://example.com/{}'.format(i) for i in range(5)]
+        for url in urls:
+            state.seen_urls.add(url)
+            state.q.put_nowait((url, 10))
+        state.q.get_nowait()
+        state.checkpoint([(urls[0], 10)])
+
+        # Work after the checkpoint is forgotten.
+        state.q.get_nowait()
+        state.seen_urls.add('http://example.com/later')
+        state.close()
+
+        state = self.open_state()
+        self.assertTrue(state.resumed)
+        self.assertEqual(state.in_flight, [(urls[0], 10)])
+        self.assertEqual(state.q.qsize(), 4)
+        self.assertEqual([state.q.get_nowait() for _ in range(4)],
+                         [(url, 10) for url in urls[1:]])
+        self.assertIn(urls[4], state.seen_urls)
+        self.assertNotIn('http://example.com/later', state.seen_urls)
+
+    def test_read_segments_removed(self):
+        state = self.open_state()
+        for i in range(6):
+            state.q.put_nowait(('http://example.com/{}'.format(i), 10))
+        for _ in range(5):
+            state.q.get_nowait()
+        state.checkpoint([])
+        segments = [name for name in os.listdir(self.state_dir)
+                    if name.startswith('segment-')]
+        # Segment 2 is still being read, and segment 3 written.
+        self.assertEqual(sorted(segments), ['segment-2', 'segment-3'])
+
+
+class TestLinkExtractor(unittest.TestCase):
+
+    def test_chunks(self):
+        body = b'<a HREF="/a#top">a</a> <a href=\'/b\'> <a href="/a">'
+        for size in range(1, len(body) + 1):
+            extractor = crawling.LinkExtractor()
+            for i in range(0, len(body), size):
+                extractor.feed(body[i:i + size])
+            extractor.close()
+            self.assertEqual(extractor.links, {'/a', '/b'})
+
+    def test_encoding(self):
+        extractor = crawling.LinkExtractor('latin-1')
+        extractor.feed('<a href="/caf\xe9">'.encode('latin-1'))
+        extractor.close()
+        self.assertEqual(extractor.links, {'/caf\xe9'})
+
+        # An unknown charset falls back to UTF-8.
+        self.assertEqual(crawling.LinkExtractor('bogus').encoding, 'utf-8')
+
+
+class TestDedup(unittest.TestCase):
+
+    def test_fingerprint_set(self):
+        fingerprints = dedup.FingerprintSet(capacity=4)
+        values = [0, 1, 2 ** 64 - 1] + [i << 40 for i in range(100)]
+        fingerprints.update(values)
+        fingerprints.update(values)
+        self.assertEqual(len(fingerprints), len(set(values)) - 1)
+        for value in values:
+            self.assertIn(value, fingerprints)
+        self.assertNotIn(12345, fingerprints)
+
+    def test_scalable_bloom_filter(self):
+        bloom = dedup.ScalableBloomFilter(error_rate=0.01, capacity=100)
+        values = [frontier.fingerprint(str(i)) for i in range(1000)]
+        bloom.update(values)
+        self.assertGreater(len(bloom.filters), 1)
+        for value in values:
+            self.assertIn(value, bloom)
+        others = [frontier.fingerprint(str(-i)) for i in range(1, 1001)]
+        false_positives = sum(value in bloom for value in others)
+        self.assertLess(false_positives, 30)
+
+    def test_url_set(self):
+        urls = dedup.URLSet(dedup.make_fingerprints('fingerprint'))
+        urls.update(['http://example.com/', 'http://example.com/'])
+        self.assertEqual(len(urls), 1)
+        self.assertIn('http://example.com/', urls)
+        self.assertNotIn('http://example.com/foo', urls)
+        self.assertLess(dedup.memory_size(urls),
+                        dedup.memory_size({str(i) for i in range(1000)}))
+
+
+class TestHostScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+        self.addCleanup(self.loop.close)
+
+    def make_scheduler(self, **kwargs):
+        return scheduler.HostScheduler(crawling.Queue(loop=self.loop),
+                                       loop=self.loop, **kwargs)
+
+    def get(self, q):
+        return self.loop.run_until_complete(q.get())[0]
+
+    def test_round_robin(self):
+        q = self.make_scheduler()
+        for url in ['http://a/0', 'http://a/1', 'http://b/0', 'http://a/2']:
+            q.put_nowait((url, 10))
+        self.assertEqual(q.qsize(), 4)
+        self.assertEqual([self.get(q) for _ in range(4)],
+                         ['http://a/0', 'http://b/0',
+                          'http://a/1', 'http://a/2'])
+        self.assertEqual(q.qsize(), 0)
+
+    def test_max_per_host(self):
+        q = self.make_scheduler(max_per_host=1)
+        for url in ['http://a/0', 'http://a/1', 'http://b/0']:
+            q.put_nowait((url, 10))
+        self.assertEqual(self.get(q), 'http://a/0')
+        self.assertEqual(self.get(q), 'http://b/0')
+        # Host a is busy, so its next URL waits for release().
+        self.assertEqual(q.items(), [('http://a/1', 10)])
+        self.loop.call_soon(q.release, 'http://a/0')
+        self.assertEqual(self.get(q), 'http://a/1')
+
+    def test_full_host_queue(self):
+        q = self.make_scheduler(max_per_host=1, max_buffered_per_host=2)
+        for i in range(6):
+            q.put_nowait(('http://slow/{}'.format(i), 10))
+        q.put_nowait(('http://fast/0', 10))
+        self.assertEqual(self.get(q), 'http://slow/0')
+        # Slow is busy and its queue is full, but fast is still found.
+        self.assertEqual(self.get(q), 'http://fast/0')
+        # The rest of slow's URLs wait in its backlog, in order.
+        self.assertEqual(q.qsize(), 5)
+        self.assertEqual(len(q.hosts['slow']), 2)
+        self.assertEqual([url for url, _ in q.items()],
+                         ['http://slow/{}'.format(i) for i in range(1, 6)])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,15 +1,34 @@
 import os
 
+from dbdb.binary_tree import BinaryTree, PackedBinaryTree
+from dbdb.bplus_tree import BPlusTree
 from dbdb.interface import DBDB
+from dbdb.logical import FormatError
 
 
-__all__ = ['DBDB', 'connect']
+__all__ = [
+    'DBDB', 'BinaryTree', 'BPlusTree', 'FormatError', 'PackedBinaryTree',
+    'bulk_load', 'connect',
+]
 
 
-def connect(dbname):
+def connect(dbname, tree_class=None, use_mmap=False, fsync_interval=None):
     try:
         f = open(dbname, 'r+b')
     except IOError:
-        fd = os.open(dbname, os.O_RDWR | os.O_CREAT)
-        f = os.fdopen(fd, 'r+b')
-    return DBDB(f)
+        os.close(os.open(dbname, os.O_RDWR | os.O_CREAT))
+        f = open(dbname, 'r+b')
+    return DBDB(
+        f,
+        tree_class=tree_class,
+        use_mmap=use_mmap,
+        fsync_interval=fsync_interval,
+    )
+
+
+def bulk_load(dbname, items, tree_class=None):
+    db = connect(dbname, tree_class=tree_class)
+    try:
+        db.bulk_load(items)
+    finally:
+        db.close()
@@ -1,4 +1,6 @@
+import codecs
 import pickle
+import struct
 
 
 from dbdb.logical import LogicalBase, ValueRef
@@ -7,11 +9,13 @@ from dbdb.logical import LogicalBase, ValueRef
 class BinaryNode(object):
     @classmethod
     def from_node(cls, node, **kwargs):
-        length = node.length
-        if 'left_ref' in kwargs:
-            length += kwargs['left_ref'].length - node.left_ref.length
-        if 'right_ref' in kwargs:
-            length += kwargs['right_ref'].length - node.right_ref.length
+        length = kwargs.get('length')
+        if length is None:
+            length = node.length
+            if 'left_ref' in kwargs:
+                length += kwargs['left_ref'].length - node.left_ref.length
+            if 'right_ref' in kwargs:
+                length += kwargs['right_ref'].length - node.right_ref.length
 
         return cls(
             left_ref=kwargs.get('left_ref', node.left_ref),
@@ -28,6 +32,14 @@ class BinaryNode(object):
         self.right_ref = right_ref
         self.length = length
 
+    @property
+    def refs(self):
+        return [self.left_ref, self.value_ref, self.right_ref]
+
+    def with_refs(self, refs):
+        left_ref, value_ref, right_ref = refs
+        return BinaryNode(left_ref, self.key, value_ref, right_ref, self.length)
+
     def store_refs(self, storage):
         self.value_ref.store(storage)
         self.left_ref.store(storage)
@@ -70,8 +82,65 @@ class BinaryNodeRef(ValueRef):
         )
 
 
+class PackedBinaryNodeRef(BinaryNodeRef):
+    # Version 1 layout: version, left, value and right addresses, length and
+    # a key type code, followed by the encoded key up to the end of the
+    # record. Pickled nodes (whose first byte is never 1) are still read, so
+    # an existing database migrates as nodes are rewritten, or all at once
+    # by compacting it.
+    VERSION = 1
+    HEADER = struct.Struct('!BQQQQc')
+    BYTES_KEY = b'b'
+    TEXT_KEY = b's'
+    PICKLED_KEY = b'p'
+
+    @classmethod
+    def referent_to_string(cls, referent):
+        key = referent.key
+        if isinstance(key, bytes):
+            key_type, key_bytes = cls.BYTES_KEY, key
+        elif isinstance(key, type(u'')):
+            key_type, key_bytes = cls.TEXT_KEY, key.encode('utf-8')
+        else:
+            key_type, key_bytes = cls.PICKLED_KEY, pickle.dumps(key)
+        return cls.HEADER.pack(
+            cls.VERSION,
+            referent.left_ref.address,
+            referent.value_ref.address,
+            referent.right_ref.address,
+            referent.length,
+            key_type,
+        ) + key_bytes
+
+    @classmethod
+    def string_to_referent(cls, string):
+        if struct.unpack_from('!B', string)[0] != cls.VERSION:
+            d = pickle.loads(string)
+            left, key, value, right, length = (
+                d['left'], d['key'], d['value'], d['right'], d['length'])
+        else:
+            _, left, value, right, length, key_type = (
+                cls.HEADER.unpack_from(string))
+            key_bytes = string[cls.HEADER.size:]
+            if key_type == cls.BYTES_KEY:
+                key = bytes(key_bytes)
+            elif key_type == cls.TEXT_KEY:
+                key = codecs.decode(key_bytes, 'utf-8')
+            else:
+                key = pickle.loads(key_bytes)
+        return BinaryNode(
+            cls(address=left),
+            key,
+            ValueRef(address=value),
+            cls(address=right),
+            length,
+        )
+
+
 class BinaryTree(LogicalBase):
     node_ref_class = BinaryNodeRef
+    format_tag = b'binary'
+    reads_formats = (b'binary',)
 
     def _get(self, node, key):
         while node is not None:
@@ -83,17 +152,40 @@ class BinaryTree(LogicalBase):
                 return self._follow(node.value_ref)
         raise KeyError
 
+    def _iter(self, node, start, stop, reverse):
+        # In-order walk with an explicit stack: sorted inserts make the tree
+        # as deep as it is long, which would overflow a recursive generator.
+        stack = []
+        while stack or node is not None:
+            if node is not None:
+                if not reverse and start is not None and node.key < start:
+                    node = self._follow(node.right_ref)
+                elif reverse and stop is not None and not node.key < stop:
+                    node = self._follow(node.left_ref)
+                else:
+                    stack.append(node)
+                    node = self._follow(
+                        node.right_ref if reverse else node.left_ref)
+                continue
+            node = stack.pop()
+            if not reverse and stop is not None and not node.key < stop:
+                return
+            if reverse and start is not None and node.key < start:
+                return
+            yield node.key, node.value_ref
+            node = self._follow(node.left_ref if reverse else node.right_ref)
+
     def _insert(self, node, key, value_ref):
         if node is None:
             new_node = BinaryNode(
                 self.node_ref_class(), key, value_ref, self.node_ref_class(), 1)
         elif key < node.key:
-            new_node = BinaryNode.from_node(
+            new_node = self._from_node(
                 node,
                 left_ref=self._insert(
                     self._follow(node.left_ref), key, value_ref))
         elif node.key < key:
-            new_node = BinaryNode.from_node(
+            new_node = self._from_node(
                 node,
                 right_ref=self._insert(
                     self._follow(node.right_ref), key, value_ref))
@@ -105,12 +197,12 @@ class BinaryTree(LogicalBase):
         if node is None:
             raise KeyError
         elif key < node.key:
-            new_node = BinaryNode.from_node(
+            new_node = self._from_node(
                 node,
                 left_ref=self._delete(
                     self._follow(node.left_ref), key))
         elif node.key < key:
-            new_node = BinaryNode.from_node(
+            new_node = self._from_node(
                 node,
                 right_ref=self._delete(
                     self._follow(node.right_ref), key))
@@ -126,7 +218,7 @@ class BinaryTree(LogicalBase):
                     replacement.key,
                     replacement.value_ref,
                     node.right_ref,
-                    left_ref.length + node.right_ref.length + 1,
+                    self._length(left_ref) + right.length + 1,
                 )
             elif left:
                 return node.left_ref
@@ -134,9 +226,65 @@ class BinaryTree(LogicalBase):
                 return node.right_ref
         return self.node_ref_class(referent=new_node)
 
+    def _build(self, items):
+        # Each stack entry is a key still waiting for its right subtree, with
+        # the complete subtree to its left. Subtrees are merged like carries
+        # in a binary counter, so the finished tree is as shallow as the
+        # number of keys allows.
+        stack = []
+        current = (self.node_ref_class(), 0, 0)
+        for key, value in items:
+            while stack and stack[-1][0][1] == current[1]:
+                current = self._build_node(stack.pop(), current)
+            stack.append((current, key, self._store_value(value)))
+            current = (self.node_ref_class(), 0, 0)
+        while stack:
+            current = self._build_node(stack.pop(), current)
+        return current[0]
+
+    def _build_node(self, entry, right):
+        (left_ref, left_height, left_length), key, value_ref = entry
+        right_ref, right_height, right_length = right
+        length = left_length + right_length + 1
+        ref = self.node_ref_class(referent=BinaryNode(
+            left_ref, key, value_ref, right_ref, length))
+        ref.store(self._storage)
+        return (
+            self.node_ref_class(address=ref.address),
+            max(left_height, right_height) + 1,
+            length,
+        )
+
+    def _length(self, ref):
+        node = self._follow(ref)
+        if node:
+            return node.length
+        else:
+            return 0
+
+    def _from_node(self, node, **kwargs):
+        # Cached nodes aren't pinned on their refs, so child lengths are
+        # looked up through _follow rather than BinaryNodeRef.length.
+        length = node.length
+        if 'left_ref' in kwargs:
+            length += (
+                self._length(kwargs['left_ref']) - self._length(node.left_ref))
+        if 'right_ref' in kwargs:
+            length += (
+                self._length(kwargs['right_ref']) -
+                self._length(node.right_ref))
+        return BinaryNode.from_node(node, length=length, **kwargs)
+
     def _find_max(self, node):
         while True:
             next_node = self._follow(node.right_ref)
             if next_node is None:
                 return node
             node = next_node
+
+
+class PackedBinaryTree(BinaryTree):
+    node_ref_class = PackedBinaryNodeRef
+    format_tag = b'packed'
+    # Pickled nodes are still read, so a BinaryTree file migrates.
+    reads_formats = (b'binary', b'packed')
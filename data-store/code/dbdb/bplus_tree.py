@@ -0,0 +1,347 @@
+from bisect import bisect_left, bisect_right
+import pickle
+
+
+from dbdb.logical import LogicalBase, ValueRef
+
+
+class BPlusLeaf(object):
+    is_leaf = True
+
+    def __init__(self, keys, value_refs):
+        self.keys = keys
+        self.value_refs = value_refs
+
+    @property
+    def length(self):
+        return len(self.keys)
+
+    @property
+    def refs(self):
+        return self.value_refs
+
+    def with_refs(self, refs):
+        return BPlusLeaf(self.keys, refs)
+
+    def store_refs(self, storage):
+        for value_ref in self.value_refs:
+            value_ref.store(storage)
+
+
+class BPlusInternal(object):
+    is_leaf = False
+
+    def __init__(self, keys, child_refs, counts):
+        self.keys = keys
+        self.child_refs = child_refs
+        self.counts = counts
+
+    @property
+    def length(self):
+        return sum(self.counts)
+
+    @property
+    def refs(self):
+        return self.child_refs
+
+    def with_refs(self, refs):
+        return BPlusInternal(self.keys, refs, self.counts)
+
+    def store_refs(self, storage):
+        for child_ref in self.child_refs:
+            child_ref.store(storage)
+
+
+class BPlusNodeRef(ValueRef):
+    def prepare_to_store(self, storage):
+        if self._referent:
+            self._referent.store_refs(storage)
+
+    def store(self, storage):
+        if self._referent is not None and not self._address:
+            self.prepare_to_store(storage)
+            self._address = storage.write_page(
+                self.referent_to_string(self._referent))
+
+    @property
+    def length(self):
+        if self._referent is None and self._address:
+            raise RuntimeError('Asking for BPlusNodeRef length of unloaded node')
+        if self._referent:
+            return self._referent.length
+        else:
+            return 0
+
+    @staticmethod
+    def referent_to_string(referent):
+        if referent.is_leaf:
+            return pickle.dumps({
+                'leaf': True,
+                'keys': referent.keys,
+                'values': [ref.address for ref in referent.value_refs],
+            })
+        return pickle.dumps({
+            'leaf': False,
+            'keys': referent.keys,
+            'children': [ref.address for ref in referent.child_refs],
+            'counts': referent.counts,
+        })
+
+    @staticmethod
+    def string_to_referent(string):
+        d = pickle.loads(string)
+        if d['leaf']:
+            return BPlusLeaf(
+                d['keys'],
+                [ValueRef(address=address) for address in d['values']],
+            )
+        return BPlusInternal(
+            d['keys'],
+            [BPlusNodeRef(address=address) for address in d['children']],
+            d['counts'],
+        )
+
+
+class BPlusTree(LogicalBase):
+    """Copy-on-write B+tree whose nodes are sized to fit one storage page.
+
+    Values live only in the leaves; internal nodes hold separator keys, where
+    ``keys[i]`` is no greater than any key under ``child_refs[i + 1]``. Nodes
+    split when their encoding outgrows a page, so the fanout adapts to the
+    size of the keys.
+    """
+    node_ref_class = BPlusNodeRef
+    format_tag = b'bplus'
+    reads_formats = (b'bplus',)
+    page_size = 4096
+    # Length prefix written in front of every record by Storage.
+    record_header_size = 8
+    # Refs that haven't been stored yet pickle as address 0; leave room for
+    # the wider integers they'll be written with.
+    address_slack = 6
+
+    @property
+    def node_capacity(self):
+        return self.page_size - self.record_header_size
+
+    def _node_size(self, node):
+        string = self.node_ref_class.referent_to_string(node)
+        return len(string) + self.address_slack * len(node.refs)
+
+    def _overflows(self, node):
+        return (
+            len(node.keys) >= 2 and
+            self._node_size(node) > self.node_capacity)
+
+    def _underfull(self, node):
+        return self._node_size(node) < self.node_capacity // 4
+
+    def _get(self, node, key):
+        while node is not None:
+            if node.is_leaf:
+                i = bisect_left(node.keys, key)
+                if i < len(node.keys) and node.keys[i] == key:
+                    return self._follow(node.value_refs[i])
+                break
+            node = self._follow(node.child_refs[bisect_right(node.keys, key)])
+        raise KeyError
+
+    def _iter(self, node, start, stop, reverse):
+        if node is None:
+            return
+        if node.is_leaf:
+            lo = 0 if start is None else bisect_left(node.keys, start)
+            hi = len(node.keys) if stop is None else bisect_left(node.keys, stop)
+            indices = range(lo, hi)
+            if reverse:
+                indices = reversed(indices)
+            for i in indices:
+                yield node.keys[i], node.value_refs[i]
+            return
+        lo = 0 if start is None else bisect_right(node.keys, start)
+        hi = len(node.keys) if stop is None else bisect_left(node.keys, stop)
+        indices = range(lo, hi + 1)
+        if reverse:
+            indices = reversed(indices)
+        for i in indices:
+            for item in self._iter(
+                    self._follow(node.child_refs[i]), start, stop, reverse):
+                yield item
+
+    def _insert(self, node, key, value_ref):
+        if node is None:
+            return self.node_ref_class(referent=BPlusLeaf([key], [value_ref]))
+        nodes, separators = self._insert_into(node, key, value_ref)
+        if len(nodes) == 1:
+            return self.node_ref_class(referent=nodes[0])
+        return self.node_ref_class(referent=self._internal_from(
+            separators, [self.node_ref_class(referent=n) for n in nodes]))
+
+    def _insert_into(self, node, key, value_ref):
+        if node.is_leaf:
+            i = bisect_left(node.keys, key)
+            keys = list(node.keys)
+            value_refs = list(node.value_refs)
+            if i < len(keys) and keys[i] == key:
+                value_refs[i] = value_ref
+            else:
+                keys.insert(i, key)
+                value_refs.insert(i, value_ref)
+            new_node = BPlusLeaf(keys, value_refs)
+        else:
+            i = bisect_right(node.keys, key)
+            nodes, separators = self._insert_into(
+                self._follow(node.child_refs[i]), key, value_ref)
+            new_node = BPlusInternal(
+                node.keys[:i] + separators + node.keys[i:],
+                node.child_refs[:i] +
+                [self.node_ref_class(referent=n) for n in nodes] +
+                node.child_refs[i + 1:],
+                node.counts[:i] +
+                [n.length for n in nodes] +
+                node.counts[i + 1:],
+            )
+        if self._overflows(new_node):
+            left, separator, right = self._split(new_node)
+            return [left, right], [separator]
+        return [new_node], []
+
+    def _delete(self, node, key):
+        if node is None:
+            raise KeyError
+        new_node = self._remove(node, key)
+        if not new_node.is_leaf and len(new_node.child_refs) == 1:
+            return new_node.child_refs[0]
+        if not new_node.keys and new_node.is_leaf:
+            return self.node_ref_class()
+        return self.node_ref_class(referent=new_node)
+
+    def _remove(self, node, key):
+        if node.is_leaf:
+            i = bisect_left(node.keys, key)
+            if i == len(node.keys) or node.keys[i] != key:
+                raise KeyError
+            return BPlusLeaf(
+                node.keys[:i] + node.keys[i + 1:],
+                node.value_refs[:i] + node.value_refs[i + 1:],
+            )
+        i = bisect_right(node.keys, key)
+        child = self._remove(self._follow(node.child_refs[i]), key)
+        keys = list(node.keys)
+        child_refs = list(node.child_refs)
+        counts = list(node.counts)
+        child_refs[i] = self.node_ref_class(referent=child)
+        counts[i] = child.length
+        if len(child_refs) > 1 and child.length == 0:
+            del child_refs[i]
+            del counts[i]
+            del keys[max(i - 1, 0)]
+        elif len(child_refs) > 1 and self._underfull(child):
+            j = i - 1 if i > 0 else i
+            merged = self._merge(
+                self._follow(child_refs[j]), keys[j],
+                self._follow(child_refs[j + 1]))
+            if self._overflows(merged):
+                left, separator, right = self._split(merged)
+                keys[j:j + 1] = [separator]
+                nodes = [left, right]
+            else:
+                del keys[j]
+                nodes = [merged]
+            child_refs[j:j + 2] = [
+                self.node_ref_class(referent=n) for n in nodes]
+            counts[j:j + 2] = [n.length for n in nodes]
+        return BPlusInternal(keys, child_refs, counts)
+
+    def _build(self, items):
+        # Each level holds the (first key, ref, count) entries of the node
+        # being filled at that height, leaves at level 0, and an upper bound
+        # on its encoded size. A node is written out once the next entry
+        # would overflow it, which adds an entry to the level above.
+        levels = []
+        for key, value in items:
+            self._build_add(levels, 0, key, self._store_value(value), 1)
+        level = 0
+        while level < len(levels):
+            entries = levels[level][0]
+            if level > 0 and level == len(levels) - 1 and len(entries) == 1:
+                return entries[0][1]
+            if entries:
+                self._build_flush(levels, level)
+            level += 1
+        return self.node_ref_class()
+
+    def _build_node(self, level, entries):
+        keys = [key for key, ref, count in entries]
+        refs = [ref for key, ref, count in entries]
+        if level == 0:
+            return BPlusLeaf(keys, refs)
+        return BPlusInternal(
+            keys[1:], refs, [count for key, ref, count in entries])
+
+    def _entry_size(self, key):
+        # Pickling the key on its own overcounts the framing, and an address
+        # and count take at most 9 bytes each, so this never underestimates.
+        return len(pickle.dumps(key)) + 18 + self.address_slack
+
+    def _build_add(self, levels, level, key, ref, count):
+        if level == len(levels):
+            levels.append([[], 0])
+        entries, size = levels[level]
+        entries.append((key, ref, count))
+        size += self._entry_size(key)
+        if size > self.node_capacity:
+            # The estimate is only an upper bound, so measure the real node
+            # before giving up on it, and continue from the measured size.
+            node = self._build_node(level, entries)
+            if self._overflows(node):
+                entries.pop()
+                self._build_flush(levels, level)
+                self._build_add(levels, level, key, ref, count)
+                return
+            size = self._node_size(node)
+        levels[level][1] = size
+
+    def _build_flush(self, levels, level):
+        entries = levels[level][0]
+        node = self._build_node(level, entries)
+        levels[level] = [[], 0]
+        ref = self.node_ref_class(referent=node)
+        ref.store(self._storage)
+        self._build_add(
+            levels, level + 1, entries[0][0],
+            self.node_ref_class(address=ref.address), node.length)
+
+    def _internal_from(self, separators, child_refs):
+        return BPlusInternal(
+            separators, child_refs, [ref.length for ref in child_refs])
+
+    def _split(self, node):
+        mid = len(node.keys) // 2
+        if node.is_leaf:
+            return (
+                BPlusLeaf(node.keys[:mid], node.value_refs[:mid]),
+                node.keys[mid],
+                BPlusLeaf(node.keys[mid:], node.value_refs[mid:]),
+            )
+        return (
+            BPlusInternal(
+                node.keys[:mid],
+                node.child_refs[:mid + 1],
+                node.counts[:mid + 1]),
+            node.keys[mid],
+            BPlusInternal(
+                node.keys[mid + 1:],
+                node.child_refs[mid + 1:],
+                node.counts[mid + 1:]),
+        )
+
+    def _merge(self, left, separator, right):
+        if left.is_leaf:
+            return BPlusLeaf(
+                left.keys + right.keys, left.value_refs + right.value_refs)
+        return BPlusInternal(
+            left.keys + [separator] + right.keys,
+            left.child_refs + right.child_refs,
+            left.counts + right.counts,
+        )
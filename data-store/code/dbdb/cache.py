@@ -0,0 +1,34 @@
+from collections import namedtuple, OrderedDict
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class LRUCache(object):
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._d = OrderedDict()
+
+    def get(self, key):
+        try:
+            value = self._d.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._d[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._d.pop(key, None)
+        self._d[key] = value
+        while len(self._d) > self.maxsize:
+            self._d.popitem(last=False)
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._d))
+
+    def __len__(self):
+        return len(self._d)
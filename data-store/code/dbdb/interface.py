@@ -1,12 +1,38 @@
-from dbdb.binary_tree import BinaryTree
+import contextlib
+import os
+import shutil
+import tempfile
+
+from dbdb.binary_tree import BinaryTree, PackedBinaryTree
+from dbdb.bplus_tree import BPlusTree
+from dbdb.logical import FormatError
 from dbdb.physical import Storage
 
 
+TREE_CLASSES = dict(
+    (tree_class.format_tag, tree_class)
+    for tree_class in (BinaryTree, PackedBinaryTree, BPlusTree))
+
+
 class DBDB(object):
 
-    def __init__(self, f):
-        self._storage = Storage(f)
-        self._tree = BinaryTree(self._storage)
+    def __init__(
+            self, f, tree_class=None, use_mmap=False, fsync_interval=None):
+        # Without a tree_class, the one that wrote the file is used, or
+        # BinaryTree for a new file.
+        self._storage = Storage(
+            f, use_mmap=use_mmap, fsync_interval=fsync_interval)
+        if tree_class is None:
+            tag = self._storage.get_format()
+            if tag is not None and tag not in TREE_CLASSES:
+                self._storage.close()
+                raise FormatError('Unknown node format %r.' % (tag,))
+            tree_class = TREE_CLASSES.get(tag, BinaryTree)
+        try:
+            self._tree = tree_class(self._storage)
+        except FormatError:
+            self._storage.close()
+            raise
 
     def _assert_not_closed(self):
         if self._storage.closed:
@@ -19,6 +45,73 @@ class DBDB(object):
         self._assert_not_closed()
         self._tree.commit()
 
+    @contextlib.contextmanager
+    def write_batch(self):
+        # Changes made inside the block are committed once on exit, or
+        # discarded if it raises.
+        self._assert_not_closed()
+        try:
+            yield self
+        except Exception:
+            self._tree.rollback()
+            raise
+        self.commit()
+
+    def update(self, items):
+        if hasattr(items, 'items'):
+            items = items.items()
+        with self.write_batch():
+            for key, value in items:
+                self._tree.set(key, value)
+
+    def bulk_load(self, items):
+        self._assert_not_closed()
+        self._tree.bulk_load(items)
+
+    def compact(self):
+        # Copies the live tree into a sibling file and renames it over this
+        # one. Other handles that already have the old file open keep
+        # reading their last root from it until they reconnect, and refuse
+        # to write to it (see Storage.lock). Snapshots taken before keep
+        # reading the old file, which is closed when they are.
+        self._assert_not_closed()
+        if self._storage.locked:
+            raise ValueError('Commit before compacting.')
+        path = os.path.abspath(self._storage.name)
+        dirname, basename = os.path.split(path)
+        self._storage.lock()
+        old_size = os.path.getsize(path)
+        fd, temp_path = tempfile.mkstemp(dir=dirname, prefix=basename + '.')
+        storage = Storage(
+            os.fdopen(fd, 'r+b'),
+            use_mmap=self._storage.use_mmap,
+            fsync_interval=self._storage.fsync_interval,
+        )
+        try:
+            shutil.copymode(path, temp_path)
+            with storage.buffered_writes():
+                root_address = self._tree.copy_to(storage)
+            storage.commit_root_address(
+                root_address, self._tree.format_tag)
+            storage.sync()
+            os.rename(temp_path, path)
+        except Exception:
+            storage.close()
+            os.remove(temp_path)
+            self._storage.unlock()
+            raise
+        storage.close()
+        self._tree.retire()
+        # Reopened by name, so that this handle notices if it is replaced
+        # in turn.
+        self._storage = Storage(
+            open(path, 'r+b'),
+            use_mmap=storage.use_mmap,
+            fsync_interval=storage.fsync_interval,
+        )
+        self._tree = type(self._tree)(self._storage)
+        return old_size - os.path.getsize(path)
+
     def __getitem__(self, key):
         self._assert_not_closed()
         return self._tree.get(key)
@@ -39,5 +132,26 @@ class DBDB(object):
         else:
             return True
 
+    def items(self, start=None, stop=None, reverse=False):
+        self._assert_not_closed()
+        return self._tree.iter_items(start, stop, reverse)
+
+    def keys(self, start=None, stop=None, reverse=False):
+        self._assert_not_closed()
+        return self._tree.iter_keys(start, stop, reverse)
+
+    def snapshot(self):
+        self._assert_not_closed()
+        return self._tree.snapshot()
+
+    def __iter__(self):
+        return self.keys()
+
+    def __reversed__(self):
+        return self.keys(reverse=True)
+
+    def cache_info(self):
+        return self._tree.cache_info()
+
     def __len__(self):
         return len(self._tree)
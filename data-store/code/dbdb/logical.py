@@ -1,3 +1,9 @@
+import codecs
+import weakref
+
+from dbdb.cache import LRUCache
+
+
 class ValueRef(object):
     def prepare_to_store(self, storage):
         pass
@@ -8,7 +14,7 @@ class ValueRef(object):
 
     @staticmethod
     def string_to_referent(string):
-        return string.decode('utf-8')
+        return codecs.decode(string, 'utf-8')
 
     def __init__(self, referent=None, address=0):
         self._referent = referent
@@ -18,9 +24,21 @@ class ValueRef(object):
     def address(self):
         return self._address
 
-    def get(self, storage):
+    def get(self, storage, cache=None):
+        # With a cache, stored referents live there (keyed by their immutable
+        # address) rather than on the ref, so cached nodes don't pin the
+        # subtrees below them.
         if self._referent is None and self._address:
-            self._referent = self.string_to_referent(storage.read(self._address))
+            if cache is None:
+                self._referent = self.string_to_referent(
+                    storage.read(self._address))
+            else:
+                referent = cache.get(self._address)
+                if referent is None:
+                    referent = self.string_to_referent(
+                        storage.read(self._address))
+                    cache.put(self._address, referent)
+                return referent
         return self._referent
 
     def store(self, storage):
@@ -29,17 +47,39 @@ class ValueRef(object):
             self._address = storage.write(self.referent_to_string(self._referent))
 
 
+class FormatError(ValueError):
+    pass
+
+
 class LogicalBase(object):
     node_ref_class = None
     value_ref_class = ValueRef
+    cache_size = 1024
+    # Tag recorded in the superblock on commit, and the tags of the files
+    # this class can read.
+    format_tag = None
+    reads_formats = ()
 
-    def __init__(self, storage):
+    def __init__(self, storage, cache_size=None):
+        tag = storage.get_format()
+        if tag is not None and tag not in self.reads_formats:
+            raise FormatError('Database has %r nodes, which %s cannot read.'
+                              % (tag, type(self).__name__))
         self._storage = storage
+        self._cache = LRUCache(cache_size or self.cache_size)
+        self._snapshots = weakref.WeakSet()
+        self._retired = False
         self._refresh_tree_ref()
 
     def commit(self):
-        self._tree_ref.store(self._storage)
-        self._storage.commit_root_address(self._tree_ref.address)
+        with self._storage.buffered_writes():
+            self._tree_ref.store(self._storage)
+        self._storage.commit_root_address(
+            self._tree_ref.address, self.format_tag)
+
+    def rollback(self):
+        self._storage.unlock()
+        self._refresh_tree_ref()
 
     def _refresh_tree_ref(self):
         self._tree_ref = self.node_ref_class(
@@ -50,6 +90,48 @@ class LogicalBase(object):
             self._refresh_tree_ref()
         return self._get(self._follow(self._tree_ref), key)
 
+    def iter_items(self, start=None, stop=None, reverse=False):
+        if not self._storage.locked:
+            self._refresh_tree_ref()
+        return self._iter_items(self._tree_ref, start, stop, reverse)
+
+    def iter_keys(self, start=None, stop=None, reverse=False):
+        if not self._storage.locked:
+            self._refresh_tree_ref()
+        return self._iter_keys(self._tree_ref, start, stop, reverse)
+
+    def _iter_items(self, root_ref, start, stop, reverse):
+        root = self._follow(root_ref)
+        for key, value_ref in self._iter(root, start, stop, reverse):
+            yield key, self._follow(value_ref)
+
+    def _iter_keys(self, root_ref, start, stop, reverse):
+        root = self._follow(root_ref)
+        for key, value_ref in self._iter(root, start, stop, reverse):
+            yield key
+
+    def snapshot(self):
+        snapshot = Snapshot(self, self.node_ref_class(
+            address=self._storage.get_root_address()))
+        self._snapshots.add(snapshot)
+        return snapshot
+
+    def retire(self):
+        # Called when the database moves to another storage: this one is
+        # closed once the snapshots still reading from it are closed.
+        self._storage.unlock()
+        self._retired = True
+        self._close_if_unused()
+
+    def _release_snapshot(self, snapshot):
+        self._snapshots.discard(snapshot)
+        if self._retired:
+            self._close_if_unused()
+
+    def _close_if_unused(self):
+        if not self._snapshots and not self._storage.closed:
+            self._storage.close()
+
     def set(self, key, value):
         if self._storage.lock():
             self._refresh_tree_ref()
@@ -62,8 +144,74 @@ class LogicalBase(object):
         self._tree_ref = self._delete(
             self._follow(self._tree_ref), key)
 
+    def bulk_load(self, items):
+        # Builds the tree from (key, value) pairs in strictly increasing key
+        # order, writing every node exactly once as soon as it is complete.
+        if self._storage.lock():
+            self._refresh_tree_ref()
+        try:
+            if self._follow(self._tree_ref) is not None:
+                raise ValueError('Can only bulk load into an empty tree.')
+            with self._storage.buffered_writes():
+                self._tree_ref = self._build(self._check_sorted(items))
+        except Exception:
+            # Nodes already written are left unreachable, as after any
+            # rollback.
+            self.rollback()
+            raise
+        self.commit()
+
+    def _check_sorted(self, items):
+        first = True
+        for key, value in items:
+            if not first and not previous < key:
+                raise ValueError('Bulk loaded keys must be strictly increasing.')
+            first = False
+            previous = key
+            yield key, value
+
+    def _store_value(self, value):
+        value_ref = self.value_ref_class(value)
+        value_ref.store(self._storage)
+        return value_ref
+
+    def copy_to(self, storage):
+        # Streams the committed tree into another storage, post-order so that
+        # every child already has its new address when its parent is written.
+        # Nodes are decoded without caching them on their refs, and values
+        # are copied as raw bytes, so memory is bounded by the tree depth.
+        root_address = self._storage.get_root_address()
+        if not root_address:
+            return 0
+        stack = [(self._read_node(root_address), [])]
+        while True:
+            node, copied = stack[-1]
+            if len(copied) < len(node.refs):
+                ref = node.refs[len(copied)]
+                if not ref.address:
+                    copied.append(type(ref)())
+                elif isinstance(ref, self.node_ref_class):
+                    stack.append((self._read_node(ref.address), []))
+                else:
+                    copied.append(type(ref)(address=storage.write(
+                        self._storage.read(ref.address))))
+                continue
+            stack.pop()
+            new_ref = self.node_ref_class(referent=node.with_refs(copied))
+            new_ref.store(storage)
+            if not stack:
+                return new_ref.address
+            stack[-1][1].append(self.node_ref_class(address=new_ref.address))
+
+    def _read_node(self, address):
+        return self.node_ref_class.string_to_referent(
+            self._storage.read(address))
+
     def _follow(self, ref):
-        return ref.get(self._storage)
+        return ref.get(self._storage, self._cache)
+
+    def cache_info(self):
+        return self._cache.info()
 
     def __len__(self):
         if not self._storage.locked:
@@ -73,3 +221,62 @@ class LogicalBase(object):
             return root.length
         else:
             return 0
+
+
+class Snapshot(object):
+    # A read-only view of the tree as of the last commit when it was taken.
+    # Committed nodes are never overwritten, so reading through a pinned root
+    # address stays consistent without locking while writers append.
+    def __init__(self, tree, root_ref):
+        self._tree = tree
+        self._root_ref = root_ref
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._root_ref is not None:
+            self._root_ref = None
+            self._tree._release_snapshot(self)
+
+    def _root(self):
+        if self._root_ref is None:
+            raise ValueError('Snapshot closed.')
+        return self._root_ref
+
+    @property
+    def address(self):
+        return self._root().address
+
+    def __getitem__(self, key):
+        return self._tree._get(self._tree._follow(self._root()), key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        else:
+            return True
+
+    def items(self, start=None, stop=None, reverse=False):
+        return self._tree._iter_items(self._root(), start, stop, reverse)
+
+    def keys(self, start=None, stop=None, reverse=False):
+        return self._tree._iter_keys(self._root(), start, stop, reverse)
+
+    def __iter__(self):
+        return self.keys()
+
+    def __reversed__(self):
+        return self.keys(reverse=True)
+
+    def __len__(self):
+        root = self._tree._follow(self._root())
+        if root:
+            return root.length
+        else:
+            return 0
@@ -6,20 +6,46 @@
 # (Degenerate because you can't pick the keys, and it never releases storage,
 # even when it becomes unreachable!)
 
+import contextlib
+import mmap
 import os
 import struct
+import time
 
 import portalocker
 
 
 class Storage(object):
     SUPERBLOCK_SIZE = 4096
+    PAGE_SIZE = 4096
     INTEGER_FORMAT = "!Q"
     INTEGER_LENGTH = 8
+    # The superblock holds the root address, then a tag naming the node
+    # format, padded with zeroes (all zeroes in files from before tags).
+    FORMAT_ADDRESS = INTEGER_LENGTH
+    FORMAT_LENGTH = 8
 
-    def __init__(self, f):
+    WRITE_BUFFER_SIZE = 1 << 20
+
+    def __init__(self, f, use_mmap=False, fsync_interval=None):
+        # fsync_interval: None never fsyncs, 0 fsyncs every commit, and a
+        # number of seconds fsyncs on the first commit after it has elapsed.
         self._f = f
+        # The path is checked on every lock, to catch the file having been
+        # replaced (e.g. by compaction through another handle) since it was
+        # opened. Files opened without a usable name aren't checked.
+        name = getattr(f, 'name', None)
+        if isinstance(name, str) and os.path.exists(name):
+            self._path = os.path.abspath(name)
+        else:
+            self._path = None
         self.locked = False
+        self.use_mmap = use_mmap
+        self.fsync_interval = fsync_interval
+        self._last_sync = 0
+        self._mmap = None
+        self._pending = None
+        self._pending_address = 0
         self._ensure_superblock()
 
     def _ensure_superblock(self):
@@ -33,13 +59,30 @@ class Storage(object):
     def lock(self):
         if not self.locked:
             portalocker.lock(self._f, portalocker.LOCK_EX)
+            if self._replaced():
+                portalocker.unlock(self._f)
+                raise ValueError(
+                    'Database file was replaced since it was opened; '
+                    'reconnect before writing.')
             self.locked = True
             return True
         else:
             return False
 
+    def _replaced(self):
+        if self._path is None:
+            return False
+        try:
+            current = os.stat(self._path)
+        except OSError:
+            return True
+        opened = os.fstat(self._f.fileno())
+        return (current.st_dev, current.st_ino) != (
+            opened.st_dev, opened.st_ino)
+
     def unlock(self):
         if self.locked:
+            self._flush_pending()
             self._f.flush()
             portalocker.unlock(self._f)
             self.locked = False
@@ -63,37 +106,156 @@ class Storage(object):
         self.lock()
         self._f.write(self._integer_to_bytes(integer))
 
-    def write(self, data):
+    @contextlib.contextmanager
+    def buffered_writes(self):
+        # Collects the records written inside the block into one contiguous
+        # append, instead of a seek, flush and two writes per record.
         self.lock()
+        if self._pending is None:
+            self._seek_end()
+            self._pending_address = self._f.tell()
+            self._pending = bytearray()
+        try:
+            yield
+        finally:
+            self._flush_pending()
+
+    def _write_pending(self):
+        self._f.seek(self._pending_address)
+        self._f.write(self._pending)
+        self._pending_address += len(self._pending)
+        self._pending = bytearray()
+
+    def _flush_pending(self):
+        if self._pending is not None:
+            self._write_pending()
+            self._pending = None
+
+    def _end_address(self):
+        if self._pending is not None:
+            return self._pending_address + len(self._pending)
         self._seek_end()
-        object_address = self._f.tell()
-        self._write_integer(len(data))
-        self._f.write(data)
+        return self._f.tell()
+
+    def write(self, data):
+        self.lock()
+        if self._pending is None:
+            self._seek_end()
+            object_address = self._f.tell()
+            self._write_integer(len(data))
+            self._f.write(data)
+            return object_address
+        object_address = self._end_address()
+        self._pending += self._integer_to_bytes(len(data))
+        self._pending += data
+        if len(self._pending) >= self.WRITE_BUFFER_SIZE:
+            self._write_pending()
         return object_address
 
+    def write_page(self, data):
+        self.lock()
+        padding = -self._end_address() % self.PAGE_SIZE
+        if padding:
+            if self._pending is None:
+                self._f.write(b'\x00' * padding)
+            else:
+                self._pending += b'\x00' * padding
+        return self.write(data)
+
+    def _remap(self, size):
+        # Records already handed out as memoryviews keep the old mapping
+        # alive, so it's dropped rather than closed.
+        self._f.flush()
+        if os.fstat(self._f.fileno()).st_size < size:
+            raise ValueError('Address beyond end of file.')
+        self._mmap = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def _mapping(self, size):
+        if self._mmap is None or len(self._mmap) < size:
+            return self._remap(size)
+        return self._mmap
+
+    def _read_mapped(self, address):
+        data_address = address + self.INTEGER_LENGTH
+        mapping = self._mapping(data_address)
+        length = struct.unpack_from(self.INTEGER_FORMAT, mapping, address)[0]
+        mapping = self._mapping(data_address + length)
+        return memoryview(mapping)[data_address:data_address + length]
+
     def read(self, address):
+        if self._pending and address >= self._pending_address:
+            self._write_pending()
+        if self.use_mmap:
+            return self._read_mapped(address)
         self._f.seek(address)
         length = self._read_integer()
         data = self._f.read(length)
         return data
 
-    def commit_root_address(self, root_address):
+    def _sync_due(self):
+        if self.fsync_interval is None:
+            return False
+        now = time.time()
+        if now - self._last_sync < self.fsync_interval:
+            return False
+        self._last_sync = now
+        return True
+
+    def commit_root_address(self, root_address, tree_format=None):
         self.lock()
-        self._f.flush()
+        self._flush_pending()
+        sync = self._sync_due()
+        if sync:
+            self.sync()
+        else:
+            self._f.flush()
+        if tree_format is not None and tree_format != self.get_format():
+            self._f.seek(self.FORMAT_ADDRESS)
+            self._f.write(tree_format.ljust(self.FORMAT_LENGTH, b'\x00'))
         self._seek_superblock()
         self._write_integer(root_address)
-        self._f.flush()
+        if sync:
+            self.sync()
+        else:
+            self._f.flush()
         self.unlock()
 
     def get_root_address(self):
+        if self.use_mmap:
+            return struct.unpack_from(
+                self.INTEGER_FORMAT, self._mapping(self.INTEGER_LENGTH))[0]
         self._seek_superblock()
         root_address = self._read_integer()
         return root_address
 
+    def get_format(self):
+        end = self.FORMAT_ADDRESS + self.FORMAT_LENGTH
+        if self.use_mmap:
+            tag = bytes(self._mapping(end)[self.FORMAT_ADDRESS:end])
+        else:
+            self._f.seek(self.FORMAT_ADDRESS)
+            tag = self._f.read(self.FORMAT_LENGTH)
+        return tag.rstrip(b'\x00') or None
+
+    def sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
     def close(self):
         self.unlock()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            self._mmap = None
         self._f.close()
 
+    @property
+    def name(self):
+        return self._f.name
+
     @property
     def closed(self):
         return self._f.closed
@@ -1,9 +1,11 @@
+import contextlib
 import pickle
 import random
 
 from nose.tools import assert_raises, eq_
 
-from dbdb.binary_tree import BinaryNode, BinaryTree, BinaryNodeRef, ValueRef
+from dbdb.binary_tree import (
+    BinaryNode, BinaryTree, BinaryNodeRef, PackedBinaryNodeRef, ValueRef)
 
 
 class StubStorage(object):
@@ -24,6 +26,9 @@ class StubStorage(object):
     def get_root_address(self):
         return 0
 
+    def get_format(self):
+        return None
+
     def write(self, string):
         address = len(self.d)
         self.d.append(string)
@@ -32,6 +37,10 @@ class StubStorage(object):
     def read(self, address):
         return self.d[address]
 
+    @contextlib.contextmanager
+    def buffered_writes(self):
+        yield
+
 
 class TestBinaryTree(object):
     def setup(self):
@@ -99,6 +108,38 @@ class TestBinaryTree(object):
         self.tree.get('a')
         self.tree.get('c')
 
+    def test_iter_in_order(self):
+        keys = random.sample(range(1000), 100)
+        for k in keys:
+            self.tree.set(k, str(k))
+        eq_([k for k, v in self.tree.iter_items()], sorted(keys))
+        eq_(list(self.tree.iter_keys(reverse=True)), sorted(keys, reverse=True))
+
+    def test_iter_range(self):
+        for k in range(100):
+            self.tree.set(k, str(k))
+        eq_(list(self.tree.iter_items(10, 13)), [(10, '10'), (11, '11'), (12, '12')])
+        eq_(list(self.tree.iter_keys(10, 13, reverse=True)), [12, 11, 10])
+        eq_(list(self.tree.iter_keys(start=97)), [97, 98, 99])
+        eq_(list(self.tree.iter_keys(stop=2, reverse=True)), [1, 0])
+
+    def test_bulk_load_is_balanced(self):
+        def depth(node):
+            if node is None:
+                return 0
+            return 1 + max(
+                depth(self.tree._follow(node.left_ref)),
+                depth(self.tree._follow(node.right_ref)))
+        for n in (1, 2, 3, 4, 7, 8, 100, 1023):
+            self.tree = BinaryTree(StubStorage())
+            self.tree._storage.commit_root_address = (
+                lambda address, tree_format=None: None)
+            self.tree.bulk_load((k, str(k)) for k in range(n))
+            eq_(len(self.tree), n)
+            eq_(list(self.tree.iter_keys()), list(range(n)))
+            eq_(depth(self.tree._follow(self.tree._tree_ref)),
+                n.bit_length())
+
 
 class TestBinaryNodeRef(object):
     def test_to_string_leaf(self):
@@ -120,3 +161,30 @@ class TestBinaryNodeRef(object):
         eq_(d['key'], 'k')
         eq_(d['value'], 999)
         eq_(d['right'], 321)
+
+
+class TestPackedBinaryNodeRef(object):
+    def _round_trip(self, key):
+        n = BinaryNode(
+            PackedBinaryNodeRef(address=123), key, ValueRef(address=999),
+            PackedBinaryNodeRef(address=321), 3)
+        return PackedBinaryNodeRef.string_to_referent(
+            PackedBinaryNodeRef.referent_to_string(n))
+
+    def test_round_trip(self):
+        for key in [u'k\xe9y', b'key', 42, (1, 'a')]:
+            node = self._round_trip(key)
+            eq_(node.key, key)
+            eq_(node.left_ref.address, 123)
+            eq_(node.value_ref.address, 999)
+            eq_(node.right_ref.address, 321)
+            eq_(node.length, 3)
+
+    def test_reads_pickled_node(self):
+        n = BinaryNode(BinaryNodeRef(address=5), 'k', ValueRef(address=6),
+                       BinaryNodeRef(), 2)
+        node = PackedBinaryNodeRef.string_to_referent(
+            memoryview(BinaryNodeRef.referent_to_string(n)))
+        eq_(node.key, 'k')
+        eq_(node.left_ref.address, 5)
+        assert isinstance(node.left_ref, PackedBinaryNodeRef)
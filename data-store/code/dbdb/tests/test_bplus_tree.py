@@ -0,0 +1,114 @@
+import pickle
+import random
+
+from nose.tools import assert_raises, eq_
+
+from dbdb.bplus_tree import BPlusLeaf, BPlusNodeRef, BPlusTree, ValueRef
+from dbdb.tests.test_binary_tree import StubStorage
+
+
+class StubPageStorage(StubStorage):
+    def write_page(self, string):
+        return self.write(string)
+
+
+class SmallPageBPlusTree(BPlusTree):
+    page_size = 256
+
+
+class TestBPlusTree(object):
+    def setup(self):
+        self.tree = SmallPageBPlusTree(StubPageStorage())
+
+    def _depth(self):
+        depth = 0
+        node = self.tree._follow(self.tree._tree_ref)
+        while node is not None and not node.is_leaf:
+            node = self.tree._follow(node.child_refs[0])
+            depth += 1
+        return depth
+
+    def test_get_missing_key_raises_key_error(self):
+        with assert_raises(KeyError):
+            self.tree.get('Not A Key In The Tree')
+
+    def test_set_and_get_key(self):
+        self.tree.set('a', 'b')
+        eq_(self.tree.get('a'), 'b')
+
+    def test_overwrite_and_get_key(self):
+        self.tree.set('a', 'b')
+        self.tree.set('a', 'c')
+        eq_(self.tree.get('a'), 'c')
+        eq_(len(self.tree), 1)
+
+    def test_pop_non_existent_key(self):
+        self.tree.set('a', 'b')
+        with assert_raises(KeyError):
+            self.tree.pop('Not A Key In The Tree')
+
+    def test_sorted_inserts_stay_shallow(self):
+        for i in range(2000):
+            self.tree.set(i, str(i))
+        eq_(len(self.tree), 2000)
+        for i in range(2000):
+            eq_(self.tree.get(i), str(i))
+        assert self._depth() < 6
+
+    def test_random_set_pop_keys(self):
+        keys = random.sample(range(100000), 1000)
+        for i, k in enumerate(keys, start=1):
+            self.tree.set(k, str(k))
+            eq_(len(self.tree), i)
+        random.shuffle(keys)
+        for i, k in enumerate(keys, start=1):
+            self.tree.pop(k)
+            eq_(len(self.tree), len(keys) - i)
+            with assert_raises(KeyError):
+                self.tree.get(k)
+        for k in keys[:10]:
+            self.tree.set(k, 'again')
+            eq_(self.tree.get(k), 'again')
+
+    def test_iter_range(self):
+        keys = random.sample(range(10000), 1000)
+        for k in keys:
+            self.tree.set(k, str(k))
+        keys.sort()
+        eq_(list(self.tree.iter_keys()), keys)
+        eq_(list(self.tree.iter_keys(reverse=True)), keys[::-1])
+        expected = [k for k in keys if 2500 <= k < 7500]
+        eq_(list(self.tree.iter_keys(2500, 7500)), expected)
+        eq_(list(self.tree.iter_keys(2500, 7500, reverse=True)), expected[::-1])
+        eq_(
+            list(self.tree.iter_items(keys[10], keys[12])),
+            [(keys[10], str(keys[10])), (keys[11], str(keys[11]))])
+
+    def test_commit_and_reload(self):
+        storage = StubPageStorage()
+        tree = SmallPageBPlusTree(storage)
+        for i in range(500):
+            tree.set(i, str(i))
+        tree._tree_ref.store(storage)
+        address = tree._tree_ref.address
+        storage.get_root_address = lambda: address
+        reloaded = SmallPageBPlusTree(storage)
+        eq_(len(reloaded), 500)
+        eq_(reloaded.get(321), '321')
+
+
+class TestBPlusNodeRef(object):
+    def test_to_string_leaf(self):
+        n = BPlusLeaf(['j', 'k'], [ValueRef(address=998), ValueRef(address=999)])
+        d = pickle.loads(BPlusNodeRef.referent_to_string(n))
+        eq_(d['leaf'], True)
+        eq_(d['keys'], ['j', 'k'])
+        eq_(d['values'], [998, 999])
+
+    def test_from_string_internal(self):
+        string = pickle.dumps({
+            'leaf': False, 'keys': ['b'], 'children': [10, 20], 'counts': [1, 1]})
+        node = BPlusNodeRef.string_to_referent(string)
+        eq_(node.keys, ['b'])
+        eq_([ref.address for ref in node.child_refs], [10, 20])
+        eq_(node.length, 2)
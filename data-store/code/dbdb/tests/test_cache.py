@@ -0,0 +1,27 @@
+from nose.tools import eq_
+
+from dbdb.cache import LRUCache
+
+
+class TestLRUCache(object):
+    def setup(self):
+        self.cache = LRUCache(2)
+
+    def test_miss(self):
+        eq_(self.cache.get(1), None)
+        eq_(self.cache.info(), (0, 1, 2, 0))
+
+    def test_hit(self):
+        self.cache.put(1, 'one')
+        eq_(self.cache.get(1), 'one')
+        eq_(self.cache.info(), (1, 0, 2, 1))
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put(1, 'one')
+        self.cache.put(2, 'two')
+        self.cache.get(1)
+        self.cache.put(3, 'three')
+        eq_(len(self.cache), 2)
+        eq_(self.cache.get(2), None)
+        eq_(self.cache.get(1), 'one')
+        eq_(self.cache.get(3), 'three')
@@ -8,6 +8,7 @@ from nose.tools import assert_raises, eq_
 
 import dbdb
 import dbdb.tool
+from dbdb.physical import Storage
 
 
 class TestDatabase(object):
@@ -44,6 +45,248 @@ class TestDatabase(object):
         eq_(len(db), 3)
         db.close()
 
+    def test_items_and_keys(self):
+        db = dbdb.connect(self.tempfile_name)
+        db['b'] = 'bee'
+        db['a'] = 'aye'
+        db['c'] = 'see'
+        db.commit()
+        eq_(list(db.items()), [('a', 'aye'), ('b', 'bee'), ('c', 'see')])
+        eq_(list(db.items('b')), [('b', 'bee'), ('c', 'see')])
+        eq_(list(db.keys(stop='c')), ['a', 'b'])
+        eq_(list(db), ['a', 'b', 'c'])
+        eq_(list(reversed(db)), ['c', 'b', 'a'])
+        db.close()
+
+    def test_mmap_reads(self):
+        db = dbdb.connect(self.tempfile_name, use_mmap=True)
+        db['b'] = 'bee'
+        db['a'] = 'aye'
+        db.commit()
+        db.close()
+        db = dbdb.connect(self.tempfile_name, use_mmap=True)
+        eq_(db['a'], 'aye')
+        eq_(list(db.items()), [('a', 'aye'), ('b', 'bee')])
+        db['c'] = 'see'
+        db.commit()
+        eq_(db['c'], 'see')
+        db.close()
+
+    def test_cache_survives_refresh(self):
+        db = dbdb.connect(self.tempfile_name)
+        for k in ['d', 'b', 'f', 'a', 'c', 'e', 'g']:
+            db[k] = k
+        db.commit()
+        db['a']
+        misses = db.cache_info().misses
+        eq_(db['a'], 'a')
+        eq_(db.cache_info().misses, misses)
+        assert db.cache_info().hits > 0
+        db.close()
+
+    def test_update(self):
+        db = dbdb.connect(self.tempfile_name, fsync_interval=0)
+        db.update({'a': 'aye', 'b': 'bee'})
+        db.update([('c', 'see')])
+        db.close()
+        db = dbdb.connect(self.tempfile_name)
+        eq_(list(db.items()), [('a', 'aye'), ('b', 'bee'), ('c', 'see')])
+        db.close()
+
+    def test_write_batch_rolls_back_on_error(self):
+        db = dbdb.connect(self.tempfile_name)
+        with db.write_batch():
+            db['a'] = 'aye'
+        with assert_raises(RuntimeError):
+            with db.write_batch():
+                db['b'] = 'bee'
+                raise RuntimeError
+        eq_(list(db.keys()), ['a'])
+        db.close()
+
+    def test_bulk_load(self):
+        for tree_class in (dbdb.BinaryTree, dbdb.BPlusTree):
+            items = [('%05d' % i, str(i)) for i in range(3000)]
+            dbdb.bulk_load(self.new_tempfile_name, iter(items), tree_class)
+            db = dbdb.connect(self.new_tempfile_name, tree_class=tree_class)
+            eq_(len(db), 3000)
+            eq_(db['01234'], '1234')
+            eq_(list(db.items()), items)
+            db['x'] = 'ex'
+            del db['00000']
+            db.commit()
+            eq_(len(db), 3000)
+            with assert_raises(ValueError):
+                db.bulk_load(items)
+            db.close()
+            os.remove(self.new_tempfile_name)
+
+    def test_bulk_load_unsorted(self):
+        with assert_raises(ValueError):
+            dbdb.bulk_load(self.tempfile_name, [('b', 'bee'), ('a', 'aye')])
+        db = dbdb.connect(self.tempfile_name)
+        with assert_raises(ValueError):
+            db.bulk_load([('a', 'aye'), ('c', 'see'), ('b', 'bee')])
+        assert not db._storage.locked
+        eq_(len(db), 0)
+        db['a'] = 'aye'
+        db.commit()
+        eq_(list(db.keys()), ['a'])
+        db.close()
+
+    def test_migrate_to_packed_nodes(self):
+        db = dbdb.connect(self.tempfile_name)
+        db.update(('%03d' % i, str(i)) for i in range(100))
+        db.close()
+        db = dbdb.connect(self.tempfile_name, tree_class=dbdb.PackedBinaryTree)
+        db['new'] = 'value'
+        db.commit()
+        eq_(db['050'], '50')
+        db.compact()
+        db.close()
+        with open(self.tempfile_name, 'r+b') as f:
+            storage = Storage(f)
+            root = storage.read(storage.get_root_address())
+            eq_(root[:1], b'\x01')
+        db = dbdb.connect(self.tempfile_name, tree_class=dbdb.PackedBinaryTree)
+        eq_(len(db), 101)
+        eq_(db['new'], 'value')
+        db.close()
+
+    def test_snapshot(self):
+        writer = dbdb.connect(self.tempfile_name)
+        writer.update({'a': 'aye', 'b': 'bee'})
+        reader = dbdb.connect(self.tempfile_name)
+        with reader.snapshot() as snap:
+            keys = snap.keys()
+            eq_(next(keys), 'a')
+            writer['c'] = 'see'
+            del writer['a']
+            writer.commit()
+            eq_(list(keys), ['b'])
+            eq_(snap['a'], 'aye')
+            assert 'c' not in snap
+            eq_(len(snap), 2)
+            eq_(list(snap.items()), [('a', 'aye'), ('b', 'bee')])
+            assert not reader._storage.locked
+        with assert_raises(ValueError):
+            snap['a']
+        eq_(list(reader.keys()), ['b', 'c'])
+        reader.close()
+        writer.close()
+
+    def test_compact(self):
+        for tree_class in (dbdb.BinaryTree, dbdb.BPlusTree):
+            db = dbdb.connect(self.tempfile_name, tree_class=tree_class)
+            for i in range(200):
+                db['%03d' % i] = str(i)
+                db.commit()
+            del db['100']
+            db.commit()
+            size = os.path.getsize(self.tempfile_name)
+            reclaimed = db.compact()
+            eq_(os.path.getsize(self.tempfile_name), size - reclaimed)
+            assert reclaimed > 0
+            eq_(len(db), 199)
+            eq_(db['150'], '150')
+            db['new'] = 'value'
+            db.commit()
+            db.close()
+            db = dbdb.connect(self.tempfile_name, tree_class=tree_class)
+            eq_(list(db.keys())[:3], ['000', '001', '002'])
+            eq_(db['new'], 'value')
+            with assert_raises(KeyError):
+                db['100']
+            db.close()
+            os.remove(self.tempfile_name)
+
+    def test_compact_with_other_handle(self):
+        db = dbdb.connect(self.tempfile_name)
+        db.update({'a': 'aye'})
+        other = dbdb.connect(self.tempfile_name)
+        eq_(other['a'], 'aye')
+        db.compact()
+        with assert_raises(ValueError):
+            other['b'] = 'bee'
+        assert not other._storage.locked
+        other.close()
+        db['c'] = 'see'
+        db.commit()
+        db.close()
+        db = dbdb.connect(self.tempfile_name)
+        eq_(list(db.items()), [('a', 'aye'), ('c', 'see')])
+        db.close()
+
+    def test_snapshot_survives_compact(self):
+        db = dbdb.connect(self.tempfile_name)
+        db.update({'a': 'aye', 'b': 'bee'})
+        snap = db.snapshot()
+        old_storage = db._storage
+        db.compact()
+        db['c'] = 'see'
+        db.commit()
+        eq_(list(snap.keys()), ['a', 'b'])
+        assert not old_storage.closed
+        snap.close()
+        assert old_storage.closed
+        db.close()
+
+    def test_compact_failure_unlocks(self):
+        db = dbdb.connect(self.tempfile_name)
+        db.update({'a': 'aye'})
+
+        def fail(storage):
+            raise IOError('disk full')
+        db._tree.copy_to = fail
+        with assert_raises(IOError):
+            db.compact()
+        assert not db._storage.locked
+        eq_(os.listdir(self.temp_dir), [os.path.basename(self.tempfile_name)])
+        db.close()
+
+    def test_compact_with_uncommitted_changes(self):
+        db = dbdb.connect(self.tempfile_name)
+        db['a'] = 'aye'
+        with assert_raises(ValueError):
+            db.compact()
+        db.close()
+
+    def test_tree_class_recorded(self):
+        db = dbdb.connect(self.tempfile_name, tree_class=dbdb.BPlusTree)
+        db['a'] = 'aye'
+        db.commit()
+        db.close()
+        db = dbdb.connect(self.tempfile_name)
+        assert isinstance(db._tree, dbdb.BPlusTree)
+        assert 'a' in db
+        db.close()
+        for tree_class in (dbdb.BinaryTree, dbdb.PackedBinaryTree):
+            with assert_raises(dbdb.FormatError):
+                dbdb.connect(self.tempfile_name, tree_class=tree_class)
+
+    def test_packed_tree_class_recorded(self):
+        db = dbdb.connect(self.tempfile_name, tree_class=dbdb.PackedBinaryTree)
+        db['a'] = 'aye'
+        db.commit()
+        db.close()
+        with assert_raises(dbdb.FormatError):
+            dbdb.connect(self.tempfile_name, tree_class=dbdb.BinaryTree)
+        db = dbdb.connect(self.tempfile_name, use_mmap=True)
+        assert isinstance(db._tree, dbdb.PackedBinaryTree)
+        eq_(db['a'], 'aye')
+        db.close()
+
+    def test_bplus_tree_persistence(self):
+        db = dbdb.connect(self.tempfile_name, tree_class=dbdb.BPlusTree)
+        for i in range(1000):
+            db['%05d' % i] = str(i)
+        db.commit()
+        db.close()
+        db = dbdb.connect(self.tempfile_name, tree_class=dbdb.BPlusTree)
+        eq_(len(db), 1000)
+        eq_(db['00500'], '500')
+        db.close()
+
 
 class TestTool(object):
     def setup(self):
@@ -71,3 +314,18 @@ class TestTool(object):
         self._tool('set', 'a', expected)
         actual = self._tool('get', 'a')
         eq_(actual, expected)
+
+    def test_bplus_tree(self):
+        db = dbdb.connect(self.tempfile_name, tree_class=dbdb.BPlusTree)
+        db['a'] = 'b'
+        db.commit()
+        db.close()
+        eq_(self._tool('get', 'a'), b'b')
+        assert self._tool('compact').startswith(b'Reclaimed ')
+        eq_(self._tool('get', 'a'), b'b')
+
+    def test_compact(self):
+        self._tool('set', 'a', b'b')
+        self._tool('set', 'a', b'c')
+        assert self._tool('compact').startswith(b'Reclaimed ')
+        eq_(self._tool('get', 'a'), b'c')
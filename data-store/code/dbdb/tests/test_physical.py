@@ -64,3 +64,51 @@ class TestStorage(object):
         eq_(self.p.read(a3), b'three')
         eq_(self.p.read(a4), b'four')
         eq_(self.p.get_root_address(), a4)
+
+    def test_write_page_is_aligned(self):
+        self.p.write(b'one')
+        address = self.p.write_page(b'two')
+        eq_(address % Storage.PAGE_SIZE, 0)
+        eq_(self.p.read(address), b'two')
+
+    def test_buffered_writes(self):
+        with self.p.buffered_writes():
+            a1 = self.p.write(b'one')
+            a2 = self.p.write_page(b'two')
+            eq_(self._get_f_contents(), b'\x00' * Storage.SUPERBLOCK_SIZE)
+            eq_(self.p.read(a1), b'one')
+            a3 = self.p.write(b'three')
+        eq_(a2 % Storage.PAGE_SIZE, 0)
+        eq_(self.p.read(a2), b'two')
+        eq_(self.p.read(a3), b'three')
+        superblock, data = self._get_superblock_and_data(
+            self._get_f_contents())
+        eq_(data[:11], b'\x00\x00\x00\x00\x00\x00\x00\x03one')
+
+    def test_fsync_interval(self):
+        p = Storage(self.f, fsync_interval=3600)
+        synced = []
+        p.sync = lambda: synced.append(True)
+        p.commit_root_address(p.write(b'one'))
+        p.commit_root_address(p.write(b'two'))
+        eq_(len(synced), 2)
+
+
+class TestMappedStorage(TestStorage):
+
+    def setup(self):
+        self.f = tempfile.NamedTemporaryFile()
+        self.p = Storage(self.f, use_mmap=True)
+
+    def test_read_returns_memoryview(self):
+        address = self.p.write(b'ABCDE')
+        value = self.p.read(address)
+        assert isinstance(value, memoryview)
+        eq_(value, b'ABCDE')
+
+    def test_remaps_on_growth(self):
+        a1 = self.p.write(b'one')
+        eq_(self.p.read(a1), b'one')
+        a2 = self.p.write(b'x' * 10000)
+        eq_(len(self.p.read(a2)), 10000)
+        eq_(self.p.read(a1), b'one')
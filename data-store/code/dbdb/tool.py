@@ -8,6 +8,7 @@ OK = 0
 BAD_ARGS = 1
 BAD_VERB = 2
 BAD_KEY = 3
+BAD_FORMAT = 4
 
 
 def usage():
@@ -15,19 +16,29 @@ def usage():
     print("\tpython -m dbdb.tool DBNAME get KEY", file=sys.stderr)
     print("\tpython -m dbdb.tool DBNAME set KEY VALUE", file=sys.stderr)
     print("\tpython -m dbdb.tool DBNAME delete KEY", file=sys.stderr)
+    print("\tpython -m dbdb.tool DBNAME compact", file=sys.stderr)
 
 
 def main(argv):
-    if not (4 <= len(argv) <= 5):
+    if not (3 <= len(argv) <= 5):
         usage()
         return BAD_ARGS
-    dbname, verb, key, value = (argv[1:] + [None])[:4]
-    if verb not in {'get', 'set', 'delete'}:
+    dbname, verb, key, value = (argv[1:] + [None, None])[:4]
+    if verb not in {'get', 'set', 'delete', 'compact'}:
         usage()
         return BAD_VERB
-    db = dbdb.connect(dbname)
+    if (verb == 'compact') != (len(argv) == 3):
+        usage()
+        return BAD_ARGS
+    try:
+        db = dbdb.connect(dbname)
+    except dbdb.FormatError as e:
+        print(e, file=sys.stderr)
+        return BAD_FORMAT
     try:
-        if verb == 'get':
+        if verb == 'compact':
+            print("Reclaimed %d bytes" % db.compact())
+        elif verb == 'get':
             sys.stdout.write(db[key])
         elif verb == 'set':
             db[key] = value
@@ -0,0 +1,174 @@
+import sys, os, time, random
+from itertools import combinations
+
+import flow
+from neighbourhood import swapped
+
+#################################################################
+## Compares evaluating neighbourhoods from scratch with the
+##  incremental evaluation that reuses the head and tail
+##  completion times of the current permutation (flow.Timetable).
+##
+## Usage: python benchmark.py [<Taillard problem file> ...]
+##  (defaults to every file in the instances directory)
+##
+## With --target, instead runs the solver on every instance in a
+##  file and reports how long it took to come within <gap> percent
+##  of the instance's known upper bound. The solver settings can
+##  be overridden to tune them, and a trace of every iteration can
+##  be written (as in flow.py).
+##
+## Usage: python benchmark.py --target <Taillard problem file>
+##          [--seconds S] [--gap PCT] [--time-increment S]
+##          [--max-lns N] [--trace FILE]
+
+def time_it(func, repeat=3):
+    # Returns the best time out of <repeat> runs of func, and its result. The
+    #  makespan cache is emptied before each run, or the later runs would
+    #  only look up the candidates evaluated by the first
+    best = None
+    for _ in range(repeat):
+        flow.MAKESPAN_CACHE.entries.clear()
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return (best, result)
+
+def inserted(perm, i, k):
+    rest = perm[:i] + perm[i+1:]
+    return rest[:k] + [perm[i]] + rest[k:]
+
+def bench_delta(filename):
+    # Returns the timings for the swap and insertion neighbourhoods of a
+    #  random permutation for the first instance in the file
+    data = flow.parse_problem(filename)
+    perm = range(len(data))
+    random.shuffle(perm)
+    pairs = list(combinations(range(len(perm)), 2))
+    positions = random.sample(range(len(perm)), min(10, len(perm)))
+
+    def full_swaps():
+        return flow.makespans(data, [swapped(perm, pair) for pair in pairs])
+
+    def delta_swaps():
+        return flow.Timetable(data, perm).swap_makespans(pairs)
+
+    def full_insertions():
+        return [flow.makespans(data, [inserted(perm, i, k) for k in range(len(perm))])
+                for i in positions]
+
+    def delta_insertions():
+        table = flow.Timetable(data, perm)
+        return [table.insertion_makespans(i) for i in positions]
+
+    (full_swap_time, full_swap) = time_it(full_swaps)
+    (delta_swap_time, delta_swap) = time_it(delta_swaps)
+    (full_ins_time, full_ins) = time_it(full_insertions)
+    (delta_ins_time, delta_ins) = time_it(delta_insertions)
+    assert full_swap == delta_swap and full_ins == delta_ins
+
+    return (len(data), len(data[0]), full_swap_time, delta_swap_time,
+            full_ins_time, delta_ins_time)
+
+def parse_bounds(filename):
+    # Returns the (upper bound, lower bound) of every instance in the file
+    with open(filename, 'r') as f:
+        lines = map(str.strip, f.readlines())
+    return [tuple(map(int, lines[i+1].split()[3:5]))
+            for i in range(len(lines)) if lines[i].startswith('number of jobs')]
+
+def bench_target(filename, duration, gap, trace=None):
+    # Returns the results of searching each instance in the file for
+    #  <duration> seconds, starting from the NEH permutation
+    flow.initialize_strategies()
+    results = []
+    for (k, (upper, lower)) in enumerate(parse_bounds(filename), 1):
+        data = flow.parse_problem(filename, k)
+        target = upper * (1 + gap / 100.0)
+        rows = []
+
+        start = time.time()
+        perm = flow.neh(data)
+        neh_time = time.time() - start
+        neh_make = flow.makespan(data, perm)
+        (best_perm, best_make, perm, strat_weights, strat_usage, iteration) = \
+            flow.search(data, perm, {strategy: 1 for strategy in flow.STRATEGIES},
+                        duration, trace=rows.append)
+
+        # The time to target is when the best makespan first reached it
+        if neh_make <= target:
+            time_to_target = neh_time
+        else:
+            times = [row['time'] - start for row in rows if row['best'] <= target]
+            time_to_target = times[0] if times else None
+
+        if trace is not None:
+            for row in rows:
+                trace(dict(row, instance=k))
+
+        results.append((k, len(data), len(data[0]), upper, best_make,
+                        100.0 * (best_make - upper) / upper, iteration, time_to_target))
+    return results
+
+def option(args, name, default, convert):
+    # Removes "--name value" from args and returns the converted value
+    if name not in args:
+        return default
+    i = args.index(name)
+    value = convert(args[i+1])
+    del args[i:i+2]
+    return value
+
+
+if __name__ == '__main__':
+
+    args = sys.argv[1:]
+
+    if '--target' in args:
+        filename = option(args, '--target', None, str)
+        duration = option(args, '--seconds', 30.0, float)
+        gap = option(args, '--gap', 5.0, float)
+        flow.TIME_INCREMENT = option(args, '--time-increment', flow.TIME_INCREMENT, float)
+        flow.MAX_LNS_NEIGHBOURHOODS = option(args, '--max-lns', flow.MAX_LNS_NEIGHBOURHOODS, int)
+        trace = option(args, '--trace', None,
+                       lambda f: flow.TraceWriter(f, ['instance'] + flow.TRACE_FIELDS))
+
+        results = bench_target(filename, duration, gap, trace)
+        if trace is not None:
+            trace.close()
+
+        row_format = "{:>10}" * 6 + "{:>12}" * 2
+        print "\nSearching for %.1f seconds (time increment %.1f, max LNS %d), target " \
+              "within %.1f %% of the upper bound:\n" % \
+              (duration, flow.TIME_INCREMENT, flow.MAX_LNS_NEIGHBOURHOODS, gap)
+        print row_format.format('Instance', 'Jobs', 'Machines', 'Upper', 'Best',
+                                'Gap (%)', 'Iterations', 'To target')
+        for r in results:
+            print row_format.format(r[0], r[1], r[2], r[3], r[4], "%.2f" % r[5], r[6],
+                                    "%.2f" % r[7] if r[7] is not None else '-')
+        reached = [r[7] for r in results if r[7] is not None]
+        summary = "\nReached the target on %d of %d instances" % (len(reached), len(results))
+        if reached:
+            summary += " (mean time %.2f seconds)" % (sum(reached) / len(reached))
+        print summary + "\n"
+        sys.exit(0)
+
+    filenames = args
+    if not filenames:
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instances')
+        filenames = sorted([os.path.join(directory, f) for f in os.listdir(directory)
+                            if f.startswith('tai')],
+                           key=lambda f: map(int, os.path.basename(f)[3:-4].split('_')))
+
+    results = [bench_delta(filename) for filename in filenames]
+
+    row_format = "{:>10}" * 2 + "{:>16}" * 4
+    print "\nSeconds to evaluate neighbourhoods (NumPy %s):\n" % \
+        ('enabled' if flow.np is not None else 'disabled')
+    print row_format.format('Jobs', 'Machines', 'Swap (full)', 'Swap (delta)',
+                            'Insert (full)', 'Insert (delta)')
+    for r in results:
+        print row_format.format(r[0], r[1], *["%.4f" % t for t in r[2:]])
+    print
@@ -1,12 +1,18 @@
-import sys, os, time, random
+import sys, os, time, random, multiprocessing, csv, json
 
 from functools import partial
-from collections import namedtuple
-from itertools import product
+from collections import namedtuple, OrderedDict
+from itertools import product, islice
 
 import neighbourhood as neigh
 import heuristics as heur
 
+# NumPy is optional: it lets us evaluate batches of candidates at once
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 ##############
 ## Settings ##
 ##############
@@ -14,6 +20,11 @@ TIME_LIMIT = 300.0 # Time (in seconds) to run the solver
 TIME_INCREMENT = 13.0 # Time (in seconds) in between heuristic measurements
 DEBUG_SWITCH = False # Displays intermediate heuristic info when True
 MAX_LNS_NEIGHBOURHOODS = 1000 # Maximum number of neighbours to explore in LNS
+MAX_BATCH_SIZE = 65536 # Maximum number of (candidate, job) pairs evaluated at once
+EXCHANGE_INTERVAL = 30.0 # Time (in seconds) between parallel workers sharing results
+MAKESPAN_CACHE_SIZE = 10000 # Maximum number of makespans remembered (see MakespanCache)
+TRACE_FIELDS = ['time', 'worker', 'iteration', 'strategy', 'candidates', 'evaluations',
+                'evals_per_sec', 'makespan', 'best'] # Columns of the search trace
 
 
 ################
@@ -34,11 +45,13 @@ Strategy = namedtuple('Strategy', ['name', 'neighbourhood', 'heuristic'])
 def initialize_strategies():
 
     global STRATEGIES
+    STRATEGIES = []
 
     # Define the neighbourhoods (and parameters) we would like to use
     neighbourhoods = [
         ('Random Permutation', partial(neigh.neighbours_random, num=100)),
         ('Swapped Pairs', neigh.neighbours_swap),
+        ('Job Insertion (10)', partial(neigh.neighbours_insertion, num=10)),
         ('Large Neighbourhood Search (2)', partial(neigh.neighbours_LNS, size=2)),
         ('Large Neighbourhood Search (3)', partial(neigh.neighbours_LNS, size=3)),
         ('Idle Neighbourhood (3)', partial(neigh.neighbours_idle, size=3)),
@@ -50,7 +63,8 @@ def initialize_strategies():
     heuristics = [
         ('Hill Climbing', heur.heur_hillclimbing),
         ('Random Selection', heur.heur_random),
-        ('Biased Random Selection', heur.heur_random_hillclimbing)
+        ('Biased Random Selection', heur.heur_random_hillclimbing),
+        ('First Improvement', heur.heur_first_improvement)
     ]
 
     # Combine every neighbourhood and heuristic strategy
@@ -59,13 +73,55 @@ def initialize_strategies():
 
 
 
-def solve(data):
-    """Solves an instance of the flow shop scheduling problem"""
+def solve(data, workers=1, trace=None):
+    """Solves an instance of the flow shop scheduling problem
+
+    With more than one worker, independent searches run in parallel and
+    regularly share what they have learned (see solve_parallel). If given,
+    trace is called with a row (a dict with the TRACE_FIELDS) for every
+    iteration of the search."""
 
     # We initialize the strategies here to avoid cyclic import issues
     initialize_strategies()
     global STRATEGIES
 
+    print "\nSolving..."
+
+    if workers > 1:
+        (best_perm, best_make, strat_weights, strat_usage, iteration) = \
+            solve_parallel(data, workers, trace)
+
+    else:
+        # Start with the permutation built by the NEH heuristic
+        perm = neh(data)
+
+        (best_perm, best_make, perm, strat_weights, strat_usage, iteration) = \
+            search(data, perm, {strategy: 1 for strategy in STRATEGIES},
+                   TIME_LIMIT, show_progress=True, trace=trace)
+
+    print "\nWent through %d iterations." % iteration
+    print "Makespan cache: %d hits, %d misses (%.1f %% hit rate)." % \
+        (MAKESPAN_CACHE.hits, MAKESPAN_CACHE.misses, MAKESPAN_CACHE.hit_rate())
+
+    print "\n(usage) Strategy:"
+    results = sorted([(strat_weights[STRATEGIES[i]], i)
+                      for i in range(len(STRATEGIES))], reverse=True)
+    for (w, i) in results:
+        print "(%d) \t%s" % (strat_usage[STRATEGIES[i]], STRATEGIES[i].name)
+
+    return (best_perm, best_make)
+
+
+def search(data, perm, strat_weights, duration, show_progress=False, trace=None):
+    """Searches for a better permutation than perm for <duration> seconds
+
+    Returns the best permutation found and its makespan, along with the
+    permutation the search finished on, the learned strategy weights, the
+    number of times each strategy was used, and the number of iterations.
+    If given, trace is called with a row describing every iteration."""
+
+    global STRATEGIES
+
     # Record the following for each strategy:
     #  improvements: The amount a solution was improved by this strategy
     #  time_spent: The amount of time spent on the strategy
@@ -73,13 +129,9 @@ def solve(data):
     #  usage: The number of times we use a strategy
     strat_improvements = {strategy: 0 for strategy in STRATEGIES}
     strat_time_spent = {strategy: 0 for strategy in STRATEGIES}
-    strat_weights = {strategy: 1 for strategy in STRATEGIES}
+    strat_weights = dict(strat_weights)
     strat_usage = {strategy: 0 for strategy in STRATEGIES}
 
-    # Start with a random permutation of the jobs
-    perm = range(len(data))
-    random.shuffle(perm)
-
     # Keep track of the best solution
     best_make = makespan(data, perm)
     best_perm = perm
@@ -87,18 +139,16 @@ def solve(data):
 
     # Maintain statistics and timing for the iterations
     iteration = 0
-    time_limit = time.time() + TIME_LIMIT
+    time_limit = time.time() + duration
     time_last_switch = time.time()
 
-    time_delta = TIME_LIMIT / 10
+    time_delta = duration / 10.0
     checkpoint = time.time() + time_delta
     percent_complete = 10
 
-    print "\nSolving..."
-
     while time.time() < time_limit:
 
-        if time.time() > checkpoint:
+        if show_progress and time.time() > checkpoint:
             print " %d %%" % percent_complete
             percent_complete += 10
             checkpoint += time_delta
@@ -110,6 +160,7 @@ def solve(data):
 
         old_val = res
         old_time = time.time()
+        old_evaluations = evaluations()
 
         # Use the current strategy's heuristic to pick the next permutation from
         #  the set of candidates generated by the strategy's neighbourhood
@@ -126,6 +177,11 @@ def solve(data):
             best_make = res
             best_perm = perm[:]
 
+        if trace is not None:
+            trace(trace_row(iteration, strategy, len(candidates),
+                            evaluations() - old_evaluations,
+                            time.time() - old_time, res, best_make))
+
         # At regular intervals, switch the weighting on the strategies available.
         #  This way, the search can dynamically shift towards strategies that have
         #  proven more effective recently.
@@ -158,16 +214,150 @@ def solve(data):
             strat_time_spent = {strategy: 0 for strategy in STRATEGIES}
 
 
-    print " %d %%\n" % percent_complete
-    print "\nWent through %d iterations." % iteration
+    if show_progress:
+        print " %d %%\n" % percent_complete
+
+    return (best_perm, best_make, perm, strat_weights, strat_usage, iteration)
+
+
+def search_worker(args):
+    # Runs one round of search in a worker process. Strategies (which hold
+    #  functions) don't travel between processes, so weights and usage are
+    #  exchanged as lists in the order of STRATEGIES.
+    #  The trace rows, if asked for, are collected and sent back as well.
+    (data, perm, weights, duration, seed, tracing) = args
+    if not STRATEGIES:
+        initialize_strategies()
+    random.seed(seed)
+    rows = []
+    (hits, misses) = (MAKESPAN_CACHE.hits, MAKESPAN_CACHE.misses)
+    (best_perm, best_make, perm, strat_weights, strat_usage, iteration) = \
+        search(data, perm, dict(zip(STRATEGIES, weights)), duration,
+               trace=rows.append if tracing else None)
+    return (best_perm, best_make, perm,
+            [strat_weights[s] for s in STRATEGIES],
+            [strat_usage[s] for s in STRATEGIES], iteration, rows,
+            (MAKESPAN_CACHE.hits - hits, MAKESPAN_CACHE.misses - misses))
+
+
+def solve_parallel(data, workers, trace=None):
+    """Runs independent searches in a pool of <workers> processes
+
+    Every EXCHANGE_INTERVAL seconds the searches stop and share results: the
+    strategy weights are averaged across workers, and the worker that has
+    done worst so far restarts from the best permutation found by any of
+    them. The others carry on from where they were, keeping the searches
+    diverse."""
+
+    pool = multiprocessing.Pool(workers)
+
+    # The first worker starts from the NEH permutation, and the others from
+    #  random permutations to diversify the search
+    perms = [neh(data)]
+    for w in range(1, workers):
+        perm = range(len(data))
+        random.shuffle(perm)
+        perms.append(perm)
+
+    weights = [1] * len(STRATEGIES)
+    usage = [0] * len(STRATEGIES)
+    best_perm = perms[0]
+    best_make = makespan(data, best_perm)
+    iteration = 0
 
-    print "\n(usage) Strategy:"
-    results = sorted([(strat_weights[STRATEGIES[i]], i)
-                      for i in range(len(STRATEGIES))], reverse=True)
-    for (w, i) in results:
-        print "(%d) \t%s" % (strat_usage[STRATEGIES[i]], STRATEGIES[i].name)
+    # Each worker's iterations are numbered on from one round to the next, and
+    #  the trace gives the best makespan found by any worker so far
+    w_iterations = [0] * workers
+    trace_best = best_make
 
-    return (best_perm, best_make)
+    time_start = time.time()
+    time_limit = time_start + TIME_LIMIT
+    seed = random.randint(0, sys.maxint)
+
+    while time.time() < time_limit:
+
+        duration = min(EXCHANGE_INTERVAL, time_limit - time.time())
+        tasks = [(data, perms[w], weights, duration, seed + w, trace is not None)
+                 for w in range(workers)]
+        seed += workers
+        results = pool.map(search_worker, tasks)
+
+        for (w_best_perm, w_best_make, w_perm, w_weights, w_usage, w_iteration,
+             w_rows, (w_hits, w_misses)) in results:
+            if w_best_make < best_make:
+                best_make = w_best_make
+                best_perm = w_best_perm
+            usage = [u + w_u for (u, w_u) in zip(usage, w_usage)]
+            iteration += w_iteration
+
+            # Count the workers' cache lookups with our own for the report
+            MAKESPAN_CACHE.hits += w_hits
+            MAKESPAN_CACHE.misses += w_misses
+
+        # Interleave the trace rows of the workers by time
+        if trace is not None:
+            rows = [dict(row, worker=w, iteration=w_iterations[w] + row['iteration'])
+                    for w in range(workers) for row in results[w][6]]
+            for row in sorted(rows, key=lambda row: row['time']):
+                trace_best = min(trace_best, row['best'])
+                trace(dict(row, best=trace_best))
+        w_iterations = [i + r[5] for (i, r) in zip(w_iterations, results)]
+
+        perms = [r[2] for r in results]
+        worst = max(range(workers), key=lambda w: results[w][1])
+        perms[worst] = best_perm[:]
+
+        weights = [float(sum(ws)) / workers for ws in zip(*[r[3] for r in results])]
+
+        print " %d %% (best makespan: %d)" % \
+            (min(100, 100 * (time.time() - time_start) / TIME_LIMIT), best_make)
+
+    pool.close()
+    pool.join()
+
+    return (best_perm, best_make, dict(zip(STRATEGIES, weights)),
+            dict(zip(STRATEGIES, usage)), iteration)
+
+
+def trace_row(iteration, strategy, candidates, evaluations, elapsed, res, best_make):
+    # Describes one iteration of the search for the trace
+    return {'time': time.time(),
+            'worker': 0,
+            'iteration': iteration,
+            'strategy': strategy.name,
+            'candidates': candidates,
+            'evaluations': evaluations,
+            'evals_per_sec': round(evaluations / max(0.000001, elapsed), 1),
+            'makespan': res,
+            'best': best_make}
+
+
+class TraceWriter(object):
+    """Writes the rows of a search trace to a file
+
+    The rows are written as CSV, or as JSON lines when the file name ends in
+    .json or .jsonl. Times are given in seconds since the writer was created."""
+
+    def __init__(self, filename, fields=TRACE_FIELDS):
+        self.fields = fields
+        self.start = time.time()
+        self.json = os.path.splitext(filename)[1] in ('.json', '.jsonl')
+        if self.json:
+            self.file = open(filename, 'w')
+        else:
+            self.file = open(filename, 'wb')
+            self.writer = csv.DictWriter(self.file, fields, extrasaction='ignore')
+            self.writer.writeheader()
+
+    def __call__(self, row):
+        row = dict(row, time=round(row['time'] - self.start, 3))
+        if self.json:
+            self.file.write(json.dumps(OrderedDict((f, row.get(f)) for f in self.fields)) + '\n')
+        else:
+            self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
 
 
 def parse_problem(filename, k=1):
@@ -229,10 +419,184 @@ def makespan(data, perm):
     For scheduling problems, the makespan refers to the difference between
     the earliest start time of any job and the latest completion time of
     any job. Minimizing the makespan amounts to minimizing the total time
-    it takes to process all jobs from start to finish."""
+    it takes to process all jobs from start to finish.
+
+    Makespans are remembered (see MakespanCache), so asking again for a
+    recently evaluated permutation is only a lookup."""
+    key = tuple(perm)
+    make = MAKESPAN_CACHE.get(data, key)
+    if make is None:
+        make = _makespan(data, perm)
+        MAKESPAN_CACHE.put(key, make)
+    return make
+
+
+def evaluations():
+    """Returns the number of makespans computed so far, in full (the misses
+    of the makespan cache) or incrementally with a Timetable"""
+    return MAKESPAN_CACHE.misses + Timetable.scored
+
+
+def _makespan(data, perm):
     return compile_solution(data, perm)[-1][-1] + data[perm[-1]][-1]
 
 
+def makespans(data, perms):
+    """Computes the makespan of every permutation in a list of candidates
+
+    Candidates produced with their makespans already known (see
+    ScoredCandidates) are not evaluated again, and neither are those in the
+    makespan cache or repeated in the list. Otherwise, with NumPy the rest
+    are evaluated at once (see finish_times), and without it we fall back
+    to computing each makespan in turn."""
+
+    if isinstance(perms, ScoredCandidates):
+        return perms.makespans
+
+    keys = [tuple(perm) for perm in perms]
+    results = {}
+    missing = OrderedDict()
+    for (key, perm) in zip(keys, perms):
+        if key not in results and key not in missing:
+            make = MAKESPAN_CACHE.get(data, key)
+            if make is None:
+                missing[key] = perm
+            else:
+                results[key] = make
+
+    if np is None or not missing:
+        evaluated = [_makespan(data, perm) for perm in missing.values()]
+    else:
+        evaluated = finish_times(np.asarray(data), np.asarray(missing.values())).tolist()
+    for (key, make) in zip(missing.keys(), evaluated):
+        results[key] = make
+        MAKESPAN_CACHE.put(key, make)
+
+    return [results[key] for key in keys]
+
+
+class MakespanCache(object):
+    """Remembers the makespans of the most recently used permutations
+
+    Neighbourhoods often produce the same candidates again (the current
+    permutation in particular), so the makespans are kept, keyed by the
+    permutation as a tuple, and the least recently used are dropped beyond
+    <maxsize>. The cache holds makespans for one problem at a time, and is
+    emptied when used with different data."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, data, key):
+        # Returns the makespan for key, or None if it isn't known
+        if data is not self.data:
+            if data != self.data:
+                self.entries.clear()
+            self.data = data
+        make = self.entries.pop(key, None)
+        if make is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries[key] = make
+        return make
+
+    def put(self, key, make):
+        self.entries[key] = make
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        return 100.0 * self.hits / max(1, self.hits + self.misses)
+
+
+MAKESPAN_CACHE = MakespanCache(MAKESPAN_CACHE_SIZE)
+
+
+def finish_times(times, perms, start=None):
+    """Computes when the last job of each row of perms completes (NumPy only)
+
+    The batch is evaluated machine by machine. Writing S for the running
+    total of durations on a machine, the completion time
+    C[j] = max(C[j-1], P[j]) + d[j] (where P is the previous machine's
+    completion time) unrolls to C[j] = S[j] + max(P[l] - S[l-1] for l <= j),
+    which is a single cumulative maximum over the jobs of every candidate.
+    If given, start holds the time each machine becomes available."""
+
+    batch = max(1, MAX_BATCH_SIZE // perms.shape[1])
+    results = []
+    for first in range(0, len(perms), batch):
+        # durations[c][j][m] is the time for the jth job of candidate c on m
+        durations = times[perms[first:first+batch]]
+        finish = np.cumsum(durations[:, :, 0], axis=1)
+        if start is not None:
+            finish += start[0]
+        for mach in range(1, durations.shape[2]):
+            total = np.cumsum(durations[:, :, mach], axis=1)
+            ready = np.maximum.accumulate(
+                finish - total + durations[:, :, mach], axis=1)
+            if start is not None:
+                ready = np.maximum(ready, start[mach])
+            finish = total + ready
+        results.append(finish[:, -1])
+    return np.concatenate(results)
+
+
+class ScoredCandidates(list):
+    """A list of candidates along with their (already computed) makespans"""
+
+    def __init__(self, perms, makespans):
+        list.__init__(self, perms)
+        self.makespans = makespans
+
+
+class Moves(object):
+    """A neighbourhood of perm given lazily, as moves rather than candidates
+
+    Each move is a small descriptor (e.g., the pair of positions to swap)
+    that apply(perm, move) turns into a candidate. The moves are scored a
+    chunk at a time with evaluate(moves), so heuristics can consume them
+    one by one and stop early, and only the candidates picked are built.
+    The current permutation comes first, as the move None."""
+
+    def __init__(self, perm, make, moves, count, apply, evaluate):
+        self.perm = perm
+        self.make = make
+        self.moves = moves # Called for a new iterator over the <count> moves
+        self.count = count
+        self.apply = apply
+        self.evaluate = evaluate
+
+    def __len__(self):
+        return self.count + 1
+
+    def __getitem__(self, k):
+        # Builds the kth candidate (e.g., for random.choice)
+        if not 0 <= k < len(self):
+            raise IndexError(k)
+        if k == 0:
+            return self.perm
+        return self.build(next(islice(self.moves(), k - 1, None)))
+
+    def build(self, move):
+        return self.perm if move is None else self.apply(self.perm, move)
+
+    def scored(self):
+        # Yields (makespan, move) for every move, evaluating O(n) at a time
+        yield (self.make, None)
+        moves = self.moves()
+        while True:
+            chunk = list(islice(moves, max(1, len(self.perm))))
+            if not chunk:
+                return
+            for score in zip(self.evaluate(chunk), chunk):
+                yield score
+
+
 def compile_solution(data, perm):
     """Compiles a scheduling on the machines given a permutation of jobs"""
 
@@ -267,6 +631,163 @@ def compile_solution(data, perm):
 
 
 
+def completion_heads(data, perm, start=None):
+    """Computes when every job in the permutation completes on each machine
+
+    If given, start holds the time each machine becomes available."""
+
+    heads = []
+    previous = start or [0] * len(data[0])
+    for job in perm:
+        ready = 0
+        row = []
+        for mach in range(len(previous)):
+            ready = max(ready, previous[mach]) + data[job][mach]
+            row.append(ready)
+        heads.append(row)
+        previous = row
+    return heads
+
+
+def completion_tails(data, perm, end=None):
+    """Computes the time from the start of every task to the end of the schedule
+
+    This is the schedule computed backwards: the tail of a task is its
+    duration plus the longest chain of tasks that must follow it. If given,
+    end holds the tails of the jobs that follow the permutation."""
+
+    num_machines = len(data[0])
+    tails = [None] * len(perm)
+    following = end or [0] * num_machines
+    for i in reversed(range(len(perm))):
+        ready = 0
+        row = [0] * num_machines
+        for mach in reversed(range(num_machines)):
+            ready = max(ready, following[mach]) + data[perm[i]][mach]
+            row[mach] = ready
+        tails[i] = row
+        following = row
+    return tails
+
+
+class Timetable(object):
+    """Head and tail completion times for a permutation
+
+    Following Taillard's acceleration, a move that only changes the jobs at
+    positions i..j is evaluated by rescheduling just those jobs, starting
+    from the heads of position i-1, and joining the result to the tails of
+    position j+1: the makespan is the latest finish plus tail over machines."""
+
+    scored = 0 # Number of makespans computed by all timetables (see evaluations)
+
+    def __init__(self, data, perm):
+        self.data = data
+        self.perm = perm[:]
+        self.heads = completion_heads(data, perm)
+        self.tails = completion_tails(data, perm)
+
+    def makespan(self):
+        return self.heads[-1][-1]
+
+    def _join(self, heads, jobs, tails):
+        # Reschedule jobs after heads (or from time 0), then join to tails
+        finish = completion_heads(self.data, jobs, heads)[-1]
+        if tails is None:
+            return finish[-1]
+        return max([f + t for (f, t) in zip(finish, tails)])
+
+    def swap_makespan(self, i, j):
+        # Makespan after swapping the jobs at positions i < j
+        jobs = [self.perm[j]] + self.perm[i+1:j] + [self.perm[i]]
+        return self._join(self.heads[i-1] if i > 0 else None, jobs,
+                          self.tails[j+1] if j+1 < len(self.perm) else None)
+
+    def swap_makespans(self, pairs):
+        # Makespans after each of the (i, j) swaps, with i < j
+        Timetable.scored += len(pairs)
+        if np is None:
+            return [self.swap_makespan(i, j) for (i, j) in pairs]
+
+        # With NumPy, all the swaps that share a first position are evaluated
+        #  as one batch of suffixes starting from the same heads
+        times = np.asarray(self.data)
+        perm = np.asarray(self.perm)
+        by_first = {}
+        for (index, (i, j)) in enumerate(pairs):
+            by_first.setdefault(i, []).append((index, j))
+
+        results = [None] * len(pairs)
+        for (i, swaps) in by_first.items():
+            offsets = np.array([j - i for (index, j) in swaps])
+            rows = np.arange(len(swaps))
+            suffixes = np.tile(perm[i:], (len(swaps), 1))
+            suffixes[rows, 0] = perm[offsets + i]
+            suffixes[rows, offsets] = perm[i]
+            start = np.asarray(self.heads[i-1]) if i > 0 else None
+            values = finish_times(times, suffixes, start)
+            for ((index, j), value) in zip(swaps, values.tolist()):
+                results[index] = value
+        return results
+
+    def insertion_makespans(self, i):
+        # Makespans after moving the job at position i to each position of
+        #  the remaining jobs (Taillard's acceleration): inserting at position
+        #  k joins the heads of the jobs before k, the moved job, and the
+        #  tails of the jobs from k onwards, so all positions take O(n*m).
+        job = self.perm[i]
+        rest = self.perm[:i] + self.perm[i+1:]
+
+        # Heads before i and tails after i are unchanged by removing the job
+        n = len(self.perm)
+        heads = self.heads[:i] + completion_heads(
+            self.data, rest[i:], self.heads[i-1] if i > 0 else None)
+        tails = completion_tails(
+            self.data, rest[:i], self.tails[i+1] if i+1 < n else None)
+        tails += self.tails[i+1:]
+
+        return self._insertions(job, heads, tails)
+
+    def insert_makespans(self, job):
+        # Makespans after inserting a new job at each position of perm
+        return self._insertions(job, self.heads, self.tails)
+
+    def _insertions(self, job, heads, tails):
+        Timetable.scored += len(heads) + 1
+        results = []
+        for k in range(len(heads) + 1):
+            results.append(self._join(heads[k-1] if k > 0 else None, [job],
+                                      tails[k] if k < len(tails) else None))
+        return results
+
+
+# The timetable of the most recently evaluated permutation
+_timetable = None
+
+def timetable(data, perm):
+    """Returns the Timetable for a permutation, reusing the last one computed
+    for as long as the permutation stays the same"""
+    global _timetable
+    if _timetable is None or _timetable.data is not data or _timetable.perm != perm:
+        _timetable = Timetable(data, perm)
+    return _timetable
+
+
+def neh(data):
+    """Builds a permutation with the NEH heuristic (Nawaz, Enscore and Ham)
+
+    Jobs are taken in order of decreasing total processing time, and each
+    one is inserted at whichever position of the partial permutation gives
+    the smallest makespan. With the timetable of the partial permutation,
+    all positions for a job are evaluated at once."""
+
+    jobs = sorted(range(len(data)), key=lambda job: -sum(data[job]))
+    perm = jobs[:1]
+    for job in jobs[1:]:
+        results = Timetable(data, perm).insert_makespans(job)
+        perm.insert(results.index(min(results)), job)
+    return perm
+
+
 def print_solution(data, perm):
     """Prints statistics on the computed solution"""
 
@@ -297,15 +818,40 @@ def print_solution(data, perm):
     print "\n\nNote: Idle time does not include initial or final wait time.\n"
 
 
-if __name__ == '__main__':
+def main(args):
+    """Solves the problem given on the command line <args>"""
+
+    # Run the search in several processes with --workers N
+    workers = 1
+    if '--workers' in args:
+        i = args.index('--workers')
+        workers = int(args[i+1])
+        del args[i:i+2]
+
+    # Write a trace of every iteration with --trace FILE
+    trace = None
+    if '--trace' in args:
+        i = args.index('--trace')
+        trace = TraceWriter(args[i+1])
+        del args[i:i+2]
 
-    if len(sys.argv) == 2:
-        data = parse_problem(sys.argv[1])
-    elif len(sys.argv) == 3:
-        data = parse_problem(sys.argv[1], int(sys.argv[2]))
+    if len(args) == 1:
+        data = parse_problem(args[0])
+    elif len(args) == 2:
+        data = parse_problem(args[0], int(args[1]))
     else:
-        print "\nUsage: python flow.py <Taillard problem file> [<instance number>]\n"
+        print "\nUsage: python flow.py [--workers N] [--trace FILE] <Taillard problem file> [<instance number>]\n"
         sys.exit(0)
 
-    (perm, ms) = solve(data)
+    (perm, ms) = solve(data, workers, trace)
+    if trace is not None:
+        trace.close()
     print_solution(data, perm)
+
+
+if __name__ == '__main__':
+
+    # The neighbourhoods and heuristics import this module as flow, so run
+    #  that copy rather than this one (__main__) to share its state with them
+    import flow
+    flow.main(sys.argv[1:])
@@ -1,5 +1,5 @@
 
-import random
+import random, heapq
 
 import flow
 
@@ -12,10 +12,16 @@ import flow
 ##  a set of candidates that is given. The heuristic is also
 ##  given access to the problem data in order to evaluate
 ##  which candidate might be preferred.
+##
+## Candidates may also come as moves from the current
+##  permutation (see flow.Moves), which are scored lazily
+##  so that only the candidate picked has to be built.
 
 def heur_hillclimbing(data, candidates):
     # Returns the best candidate in the list
-    scores = [(flow.makespan(data, perm), perm) for perm in candidates]
+    if isinstance(candidates, flow.Moves):
+        return candidates.build(min(candidates.scored())[1])
+    scores = zip(flow.makespans(data, candidates), candidates)
     return sorted(scores)[0][1]
 
 def heur_random(data, candidates):
@@ -24,8 +30,32 @@ def heur_random(data, candidates):
 
 def heur_random_hillclimbing(data, candidates):
     # Returns a candidate with probability proportional to its rank in sorted quality
-    scores = [(flow.makespan(data, perm), perm) for perm in candidates]
     i = 0
-    while (random.random() < 0.5) and (i < len(scores) - 1):
+    while (random.random() < 0.5) and (i < len(candidates) - 1):
         i += 1
+    if isinstance(candidates, flow.Moves):
+        return candidates.build(heapq.nsmallest(i + 1, candidates.scored())[i][1])
+    scores = zip(flow.makespans(data, candidates), candidates)
     return sorted(scores)[i][1]
+
+def heur_first_improvement(data, candidates):
+    # Returns the first candidate that improves on the first one (the current
+    #  permutation), or the best one if none does. Candidates after the
+    #  improvement are never evaluated.
+    if isinstance(candidates, flow.Moves):
+        scores = candidates.scored()
+    elif isinstance(candidates, flow.ScoredCandidates):
+        scores = iter(zip(candidates.makespans, candidates))
+    else:
+        scores = ((flow.makespan(data, candidate), candidate) for candidate in candidates)
+
+    best = next(scores)
+    current = best[0]
+    for score in scores:
+        best = min(best, score)
+        if score[0] < current:
+            break
+
+    if isinstance(candidates, flow.Moves):
+        return candidates.build(best[1])
+    return best[1]
@@ -18,40 +18,86 @@ def neighbours_random(data, perm, num = 1):
     return candidates
 
 def neighbours_swap(data, perm):
-    # Returns the permutations corresponding to swapping every pair of jobs
+    # Returns the moves swapping every pair of jobs. A swap leaves the jobs
+    #  before i (and after j) in place, so the timetable of perm lets us
+    #  evaluate it without a full schedule, or even building the candidate.
+    table = flow.timetable(data, perm)
+    n = len(perm)
+    return flow.Moves(perm, table.makespan(), lambda: combinations(range(n), 2),
+                      n * (n - 1) // 2, swapped, table.swap_makespans)
+
+def swapped(perm, move):
+    # Returns perm with the jobs at the pair of positions in move swapped
+    (i, j) = move
+    candidate = perm[:]
+    candidate[i], candidate[j] = candidate[j], candidate[i]
+    return candidate
+
+def neighbours_insertion(data, perm, num = 1):
+    # Returns the permutations corresponding to removing <num> random jobs
+    #  (one at a time) and reinserting each at its best position
+    table = flow.timetable(data, perm)
     candidates = [perm]
-    for (i,j) in combinations(range(len(perm)), 2):
-        candidate = perm[:]
-        candidate[i], candidate[j] = candidate[j], candidate[i]
+    makespans = [table.makespan()]
+    for i in random.sample(range(len(perm)), min(num, len(perm))):
+        results = table.insertion_makespans(i)
+        k = results.index(min(results))
+        candidate = perm[:i] + perm[i+1:]
+        candidate.insert(k, perm[i])
         candidates.append(candidate)
-    return candidates
+        makespans.append(results[k])
+    return flow.ScoredCandidates(candidates, makespans)
 
 def neighbours_LNS(data, perm, size = 2):
     # Returns the Large Neighbourhood Search neighbours
     candidates = [perm]
 
-    # Bound the number of neighbourhoods in case there are too many jobs
-    neighbourhoods = list(combinations(range(len(perm)), size))
-    random.shuffle(neighbourhoods)
-
-    for subset in neighbourhoods[:flow.MAX_LNS_NEIGHBOURHOODS]:
-
-        # Keep track of the best candidate for each neighbourhood
-        best_make = flow.makespan(data, perm)
-        best_perm = perm
-
-        # Enumerate every permutation of the selected neighbourhood
-        for ordering in permutations(subset):
-            candidate = perm[:]
-            for i in range(len(ordering)):
-                candidate[subset[i]] = perm[ordering[i]]
-            res = flow.makespan(data, candidate)
-            if res < best_make:
-                best_make = res
-                best_perm = candidate
-
-        # Record the best candidate as part of the larger neighbourhood
-        candidates.append(best_perm)
+    # Bound the number of neighbourhoods in case there are too many jobs. There
+    #  are C(n, size) of them, so when that is more than we need they are
+    #  sampled directly rather than enumerated
+    n = len(perm)
+    total = 1
+    for i in range(size):
+        total = total * (n - i) // (i + 1)
+    if total <= flow.MAX_LNS_NEIGHBOURHOODS:
+        neighbourhoods = list(combinations(range(n), size))
+        random.shuffle(neighbourhoods)
+    else:
+        seen = set()
+        neighbourhoods = []
+        while len(neighbourhoods) < flow.MAX_LNS_NEIGHBOURHOODS:
+            subset = tuple(sorted(random.sample(range(n), size)))
+            if subset not in seen:
+                seen.add(subset)
+                neighbourhoods.append(subset)
+
+    # Every neighbourhood is compared against the current makespan
+    current_make = flow.makespan(data, perm)
+
+    # Evaluate the orderings of as many neighbourhoods at once as fit in a batch
+    num_orderings = len(list(permutations(range(size))))
+    batch = max(1, flow.MAX_BATCH_SIZE // (num_orderings * len(perm)))
+
+    for start in range(0, len(neighbourhoods), batch):
+
+        # Enumerate every permutation of the selected neighbourhoods
+        orderings = []
+        for subset in neighbourhoods[start:start+batch]:
+            for ordering in permutations(subset):
+                candidate = perm[:]
+                for i in range(len(ordering)):
+                    candidate[subset[i]] = perm[ordering[i]]
+                orderings.append(candidate)
+        results = flow.makespans(data, orderings)
+
+        # Record the best candidate for each neighbourhood as part of the
+        #  larger neighbourhood (or the current one if none is better)
+        for first in range(0, len(orderings), num_orderings):
+            best = min(range(first, first + num_orderings), key=results.__getitem__)
+            if results[best] < current_make:
+                candidates.append(orderings[best])
+            else:
+                candidates.append(perm)
 
     return candidates
 
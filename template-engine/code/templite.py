@@ -2,7 +2,19 @@
 
 # Coincidentally named the same as http://code.activestate.com/recipes/496702/
 
+import hashlib
+import marshal
+import os
 import re
+import struct
+import sys
+import types
+
+try:
+    from importlib.util import MAGIC_NUMBER
+except ImportError:
+    import imp
+    MAGIC_NUMBER = imp.get_magic()
 
 
 class TempliteSyntaxError(ValueError):
@@ -46,14 +58,18 @@ class CodeBuilder(object):
 
     def get_globals(self):
         """Execute the code, and return a dict of globals it defines."""
+        # Execute the compiled source, defining globals, and return them.
+        global_namespace = {}
+        exec(self.get_code(), global_namespace)
+        return global_namespace
+
+    def get_code(self):
+        """Compile the code, and return the code object."""
         # A check that the caller really finished all the blocks they started.
         assert self.indent_level == 0
         # Get the Python source as a single string.
         python_source = str(self)
-        # Execute the source, defining globals, and return them.
-        global_namespace = {}
-        exec(python_source, global_namespace)
-        return global_namespace
+        return compile(python_source, "<templite>", "exec")
 
 
 class Templite(object):
@@ -71,10 +87,25 @@ class Templite(object):
 
         {% if var %}...{% endif %}
 
+    Other templates can be included, or extended by overriding their blocks,
+    when the Templite is given a `loader` (see TemplateLoader)::
+
+        {% include name.html %}
+        {% extends base.html %}
+        {% block name %}...{% endblock %}
+
+    These are resolved as the template is compiled, so a whole page is still
+    rendered with a single function call.
+
     Comments are within curly-hash markers::
 
         {# This will be ignored #}
 
+    In strict mode (``strict=True``), expressions spell out how to get at
+    values, and are compiled to plain Python accesses::
+
+        {{obj.attribute}} {{dict[key]}} {{list[0]}} {{obj.method()}}
+
     Construct a Templite with the template text, then use `render` against a
     dictionary context to create a finished string::
 
@@ -91,26 +122,47 @@ class Templite(object):
             'topics': ['Python', 'Geometry', 'Juggling'],
         })
 
+    or `render_iter` to produce the text in chunks, for streaming it.
+
     """
-    def __init__(self, text, *contexts):
+    def __init__(self, text, *contexts, **options):
         """Construct a Templite with the given `text`.
 
         `contexts` are dictionaries of values to use for future renderings.
         These are good for filters and global values.
 
+        The options are `strict`: if true, the template is in strict mode,
+        and `loader`: the TemplateLoader used to find other templates named
+        by `include` and `extends` tags.
+
         """
+        self.strict = options.pop('strict', False)
+        self.loader = options.pop('loader', None)
+        if options:
+            raise TypeError("Unexpected options: %s" % ", ".join(options))
+
         self.context = {}
         for context in contexts:
             self.context.update(context)
 
         self.all_vars = set()
         self.loop_vars = set()
+        # The names of the other templates compiled into this one.
+        self.dependencies = []
 
         # We construct a function in source form, then compile it and hold onto
         # it, and execute it to render the template.
         code = CodeBuilder()
 
-        code.add_line("def render_function(context, do_dots):")
+        # Each dotted lookup gets its own DotsLookup, defined before the
+        # render function.
+        self.lookups_code = code.add_section()
+        self.num_lookups = 0
+
+        # The render function is a generator: output is gathered in `result`,
+        # and is yielded as a chunk once `flush_size` pieces have gathered at
+        # the end of a loop iteration, and at the end of the template.
+        code.add_line("def render_function(context, flush_size):")
         code.indent()
         vars_code = code.add_section()
         code.add_line("result = []")
@@ -129,8 +181,9 @@ class Templite(object):
 
         ops_stack = []
 
-        # Split the text to form a list of tokens.
-        tokens = re.split(r"(?s)({{.*?}}|{%.*?%}|{#.*?#})", text)
+        # Split the text to form a list of tokens, with other templates
+        # already included or extended.
+        tokens = self._expand(self._tokenize(text), [])
 
         for token in tokens:
             if token.startswith('{#'):
@@ -151,6 +204,8 @@ class Templite(object):
                     ops_stack.append('if')
                     code.add_line("if %s:" % self._expr_code(words[1]))
                     code.indent()
+                    # Blocks can leave an if with nothing in it.
+                    code.add_line("pass")
                 elif words[0] == 'for':
                     # A loop: iterate over expression result.
                     if len(words) != 4 or words[2] != 'in':
@@ -164,6 +219,11 @@ class Templite(object):
                         )
                     )
                     code.indent()
+                elif words[0] == 'block':
+                    # A block: only there to be overridden, by now.
+                    if len(words) != 2:
+                        self._syntax_error("Don't understand block", token)
+                    ops_stack.append('block')
                 elif words[0].startswith('end'):
                     # Endsomething.  Pop the ops stack.
                     if len(words) != 1:
@@ -174,7 +234,14 @@ class Templite(object):
                     start_what = ops_stack.pop()
                     if start_what != end_what:
                         self._syntax_error("Mismatched end tag", end_what)
-                    code.dedent()
+                    if start_what == 'for':
+                        code.add_line("if len(result) >= flush_size:")
+                        code.indent()
+                        code.add_line("yield ''.join(result)")
+                        code.add_line("del result[:]")
+                        code.dedent()
+                    if start_what != 'block':
+                        code.dedent()
                 else:
                     self._syntax_error("Don't understand tag", words[0])
             else:
@@ -190,9 +257,144 @@ class Templite(object):
         for var_name in self.all_vars - self.loop_vars:
             vars_code.add_line("c_%s = context[%r]" % (var_name, var_name))
 
-        code.add_line("return ''.join(result)")
+        code.add_line("if result:")
+        code.indent()
+        code.add_line("yield ''.join(result)")
         code.dedent()
-        self._render_function = code.get_globals()['render_function']
+        code.dedent()
+        self._use_code(code.get_code())
+
+    @classmethod
+    def from_code(cls, code, *contexts):
+        """Construct a Templite from the `code` of an earlier Templite.
+
+        This skips parsing and compiling the template text entirely.
+        `contexts` are used as in the constructor.
+
+        """
+        templite = cls.__new__(cls)
+        templite.context = {}
+        for context in contexts:
+            templite.context.update(context)
+        templite._use_code(code)
+        return templite
+
+    def _use_code(self, code):
+        """Define the render function from the compiled `code`."""
+        global_namespace = {'DotsLookup': DotsLookup}
+        exec(code, global_namespace)
+        self.code = code
+        self._render_function = global_namespace['render_function']
+
+    @staticmethod
+    def _tokenize(text):
+        """Split `text` into literal text, expressions, tags and comments."""
+        return re.split(r"(?s)({{.*?}}|{%.*?%}|{#.*?#})", text)
+
+    @staticmethod
+    def _tag_words(token):
+        """The words of `token` if it's an action tag, or None."""
+        if token.startswith('{%'):
+            return token[2:-2].strip().split()
+        return None
+
+    def _expand(self, tokens, names):
+        """Return `tokens` with include and extends tags resolved.
+
+        Included templates are spliced into the tokens in place of their tags.
+        If the first tag is an extends tag, the tokens of the named template
+        are returned instead, with its blocks replaced by the blocks defined
+        in `tokens`.  Block tags are kept, so a template extending this one
+        can override them again.
+
+        `names` are the templates being expanded, to catch recursion.
+
+        """
+        expanded = []
+        extends = None
+        for token in tokens:
+            words = self._tag_words(token)
+            if words and words[0] == 'extends':
+                if len(words) != 2:
+                    self._syntax_error("Don't understand extends", token)
+                if extends is not None or any(
+                        self._tag_words(t) for t in expanded
+                ):
+                    self._syntax_error("Extends must be the first tag", token)
+                extends = self._template_name(words[1])
+            elif words and words[0] == 'include':
+                if len(words) != 2:
+                    self._syntax_error("Don't understand include", token)
+                expanded.extend(
+                    self._template_tokens(self._template_name(words[1]), names)
+                )
+            else:
+                expanded.append(token)
+
+        if extends is None:
+            return expanded
+        blocks = self._blocks(expanded)
+        return self._override(self._template_tokens(extends, names), blocks)
+
+    def _template_name(self, word):
+        """The template name in an include or extends tag, without quotes."""
+        if word[:1] in "\"'" and word[:1] == word[-1:]:
+            word = word[1:-1]
+        return word
+
+    def _template_tokens(self, name, names):
+        """Return the expanded tokens of the template `name`."""
+        if self.loader is None:
+            self._syntax_error("No loader to find template", name)
+        if name in names:
+            self._syntax_error("Template includes itself", name)
+        if name not in self.dependencies:
+            self.dependencies.append(name)
+        text = self.loader.get_source(name)
+        return self._expand(self._tokenize(text), names + [name])
+
+    def _blocks(self, tokens):
+        """Return a dict mapping block names to the tokens inside them."""
+        blocks = {}
+        starts = []
+        for i, token in enumerate(tokens):
+            words = self._tag_words(token)
+            if not words:
+                continue
+            if words[0] == 'block':
+                if len(words) != 2:
+                    self._syntax_error("Don't understand block", token)
+                self._variable(words[1], set())
+                if words[1] in blocks or words[1] in [n for n, _ in starts]:
+                    self._syntax_error("Duplicate block", words[1])
+                starts.append((words[1], i))
+            elif words[0] == 'endblock' and starts:
+                name, start = starts.pop()
+                blocks[name] = tokens[start + 1:i]
+        return blocks
+
+    def _override(self, tokens, blocks):
+        """Return `tokens` with the contents of blocks replaced from `blocks`."""
+        result = []
+        skipping = 0
+        for token in tokens:
+            words = self._tag_words(token)
+            if skipping:
+                # Inside a block being replaced: track nested blocks to find
+                # where it ends.
+                if words and words[0] == 'block':
+                    skipping += 1
+                elif words and words[0] == 'endblock':
+                    skipping -= 1
+                    if not skipping:
+                        result.append(token)
+                continue
+            result.append(token)
+            if words and words[0] == 'block' and len(words) == 2 and \
+                    words[1] in blocks:
+                result.extend(blocks[words[1]])
+                skipping = 1
+        return result
 
     def _expr_code(self, expr):
         """Generate a Python expression for `expr`."""
@@ -202,16 +404,39 @@ class Templite(object):
             for func in pipes[1:]:
                 self._variable(func, self.all_vars)
                 code = "c_%s(%s)" % (func, code)
+        elif self.strict and re.search(r"[.[(]", expr):
+            code = self._strict_expr_code(expr)
         elif "." in expr:
             dots = expr.split(".")
             code = self._expr_code(dots[0])
             args = ", ".join(repr(d) for d in dots[1:])
-            code = "do_dots(%s, %s)" % (code, args)
+            lookup = "dots_%d" % self.num_lookups
+            self.num_lookups += 1
+            self.lookups_code.add_line("%s = DotsLookup(%s)" % (lookup, args))
+            code = "%s(%s)" % (lookup, code)
         else:
             self._variable(expr, self.all_vars)
             code = "c_%s" % expr
         return code
 
+    def _strict_expr_code(self, expr):
+        """Generate direct Python accesses for a strict mode `expr`."""
+        match = re.match(r"(\w+)((?:\.\w+|\[\w+\]|\(\))*)$", expr)
+        if not match:
+            self._syntax_error("Don't understand expression", expr)
+        self._variable(match.group(1), self.all_vars)
+        code = "c_%s" % match.group(1)
+        for access in re.findall(r"\.\w+|\[\w+\]|\(\)", match.group(2)):
+            if access.startswith("."):
+                self._attribute(access[1:])
+                code += access
+            elif access.startswith("["):
+                key = access[1:-1]
+                code += "[%s]" % (key if key.isdigit() else repr(key))
+            else:
+                code += "()"
+        return code
+
     def _syntax_error(self, msg, thing):
         """Raise a syntax error using `msg`, and showing `thing`."""
         raise TempliteSyntaxError("%s: %r" % (msg, thing))
@@ -228,25 +453,221 @@ class Templite(object):
             self._syntax_error("Not a valid name", name)
         vars_set.add(name)
 
+    def _attribute(self, name):
+        """Raise a syntax error if `name` isn't a valid attribute name."""
+        if not re.match(r"[_a-zA-Z][_a-zA-Z0-9]*$", name):
+            self._syntax_error("Not a valid attribute", name)
+
     def render(self, context=None):
         """Render this template by applying it to `context`.
 
         `context` is a dictionary of values to use in this rendering.
 
         """
+        return "".join(self._render(context, sys.maxsize))
+
+    # The number of pieces of output gathered before `render_iter` yields them.
+    FLUSH_SIZE = 1000
+
+    def render_iter(self, context=None, flush_size=None):
+        """Render this template by applying it to `context`, a chunk at a time.
+
+        Returns an iterator over the rendered text in chunks, for streaming
+        large results.  Output is yielded at the end of a loop iteration once
+        at least `flush_size` pieces (literal text or values) have been
+        produced, so memory use is bounded by `flush_size` and the output of
+        a single loop iteration.  `flush_size` defaults to `FLUSH_SIZE`.
+
+        """
+        return self._render(context, flush_size or self.FLUSH_SIZE)
+
+    def _render(self, context, flush_size):
+        """Start the render function with the complete context."""
         # Make the complete context we'll use.
         render_context = dict(self.context)
         if context:
             render_context.update(context)
-        return self._render_function(render_context, self._do_dots)
+        return self._render_function(render_context, flush_size)
 
-    def _do_dots(self, value, *dots):
-        """Evaluate dotted expressions at runtime."""
-        for dot in dots:
-            try:
-                value = getattr(value, dot)
-            except AttributeError:
+
+class DotsLookup(object):
+    """Evaluate a dotted expression at runtime, for one place in a template.
+
+    Each step of `value.a.b` gets an attribute if there is one, and otherwise
+    an item, and then calls the result if it's callable.  Trying for an
+    attribute that isn't there raises and catches an exception, which is
+    slow, so each step remembers the types that it had to index, and indexes
+    their values straight away next time.
+
+    Only types whose instances can't have attributes of their own are
+    remembered (dicts, for instance), so the result is always the same as
+    the full lookup.
+
+    """
+    def __init__(self, *dots):
+        self.dots = dots
+        self.indexed = [set() for _ in dots]
+
+    def __call__(self, value):
+        for i, dot in enumerate(self.dots):
+            value_type = type(value)
+            if value_type in self.indexed[i]:
                 value = value[dot]
+            else:
+                try:
+                    new_value = getattr(value, dot)
+                except AttributeError:
+                    new_value = value[dot]
+                    if self._fixed_attributes(value):
+                        self.indexed[i].add(value_type)
+                value = new_value
             if callable(value):
                 value = value()
         return value
+
+    @staticmethod
+    def _fixed_attributes(value):
+        """Do all values of the type of `value` have the same attributes?"""
+        value_type = type(value)
+        return not (
+            hasattr(value, '__dict__') or
+            hasattr(value_type, '__slots__') or
+            hasattr(value_type, '__getattr__') or
+            isinstance(value_type.__getattribute__, types.FunctionType)
+        )
+
+
+class TemplateLoader(object):
+    """Load templates from files, compiling each distinct template just once.
+
+    Templates are found by name in `directory`.  Their compiled code is kept
+    in memory, keyed by a hash of the template text, so constructing the same
+    template again costs only a dictionary lookup.
+
+    If `cache_dir` is given, the compiled code is also written there with
+    `marshal`, so that later processes can skip compilation as well.  A cached
+    file is used only while the template file has the modification time it
+    had when the cache was written.
+
+    Templates loaded can include and extend the other templates in
+    `directory`.  Compiled code is used only while those templates also keep
+    the modification times they had when it was compiled.
+
+    """
+    # Cache files start with the Python magic number, the version of the code
+    # Templite generates, and the template file's modification time.
+    CACHE_HEADER = struct.Struct("!4sHd")
+    CODE_VERSION = 4
+
+    def __init__(self, directory, cache_dir=None):
+        self.directory = directory
+        self.cache_dir = cache_dir
+        self.codes = {}
+
+    def load(self, name, *contexts, **options):
+        """Return a Templite for the template file `name`.
+
+        `contexts` and `options` are used as in the Templite constructor.
+
+        """
+        filename = os.path.join(self.directory, name)
+        mtime = os.path.getmtime(filename)
+        with open(filename) as f:
+            text = f.read()
+
+        # Entries in the caches are the compiled code, and the modification
+        # times of the templates it depends on.
+        key = self._key(text, options)
+        entry = self.codes.get(key)
+        if not self._fresh(entry):
+            entry = self._read_cache(filename, mtime, options)
+            if not self._fresh(entry):
+                entry = self._compile(text, options)
+                self._write_cache(filename, mtime, options, entry)
+            self.codes[key] = entry
+        return Templite.from_code(entry[0], *contexts)
+
+    def from_string(self, text, *contexts, **options):
+        """Return a Templite for `text`, compiling it only if it's new."""
+        key = self._key(text, options)
+        entry = self.codes.get(key)
+        if not self._fresh(entry):
+            entry = self.codes[key] = self._compile(text, options)
+        return Templite.from_code(entry[0], *contexts)
+
+    def get_source(self, name):
+        """Return the text of the template file `name`."""
+        with open(os.path.join(self.directory, name)) as f:
+            return f.read()
+
+    def _compile(self, text, options):
+        """Compile `text`, returning a cache entry for it."""
+        templite = Templite(text, loader=self, **options)
+        mtimes = {}
+        for name in templite.dependencies:
+            mtimes[name] = os.path.getmtime(os.path.join(self.directory, name))
+        return templite.code, mtimes
+
+    def _fresh(self, entry):
+        """Is `entry` up to date with the templates it depends on?"""
+        if entry is None:
+            return False
+        for name, mtime in entry[1].items():
+            try:
+                if os.path.getmtime(os.path.join(self.directory, name)) != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def _key(self, text, options):
+        """The key for `text` compiled with `options` in the code cache."""
+        if not isinstance(text, bytes):
+            text = text.encode('utf-8')
+        return hashlib.sha1(text).hexdigest() + repr(sorted(options.items()))
+
+    def _cache_filename(self, filename, options):
+        """The file in `cache_dir` holding the code compiled from `filename`."""
+        path = os.path.abspath(filename) + repr(sorted(options.items()))
+        return os.path.join(
+            self.cache_dir, hashlib.sha1(path.encode('utf-8')).hexdigest() + ".tplc"
+        )
+
+    def _read_cache(self, filename, mtime, options):
+        """Return the cached entry for `filename`, or None if there isn't any."""
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._cache_filename(filename, options), 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        header_size = self.CACHE_HEADER.size
+        try:
+            magic, version, cached_mtime = \
+                self.CACHE_HEADER.unpack(data[:header_size])
+            if (magic != MAGIC_NUMBER or version != self.CODE_VERSION or
+                    cached_mtime != mtime):
+                return None
+            return marshal.loads(data[header_size:])
+        except (struct.error, EOFError, ValueError, TypeError):
+            # A cache file from another Python, or a partly written one.
+            return None
+
+    def _write_cache(self, filename, mtime, options, entry):
+        """Write the `entry` for `filename` to the cache, if there is one."""
+        if self.cache_dir is None:
+            return
+        cache_filename = self._cache_filename(filename, options)
+        header = self.CACHE_HEADER.pack(MAGIC_NUMBER, self.CODE_VERSION, mtime)
+        data = header + marshal.dumps(entry)
+        # Write to a temporary file and rename it, so that no process ever
+        # reads a partly written cache file.
+        temp_filename = "%s.%d" % (cache_filename, os.getpid())
+        with open(temp_filename, 'wb') as f:
+            f.write(data)
+        try:
+            os.rename(temp_filename, cache_filename)
+        except OSError:
+            # Windows won't rename over an existing file.
+            os.remove(temp_filename)
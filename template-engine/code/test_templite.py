@@ -1,7 +1,11 @@
 """Tests for templite."""
 
+import os
 import re
-from templite import Templite, TempliteSyntaxError
+import shutil
+import tempfile
+import templite
+from templite import Templite, TempliteSyntaxError, TemplateLoader, DotsLookup
 from unittest import TestCase
 
 # pylint: disable=W0612,E1101
@@ -273,3 +277,312 @@ class TempliteTest(TestCase):
             self.try_render("{% if x %}X{% end if %}")
         with self.assertSynErr("Don't understand end: '{% endif now %}'"):
             self.try_render("{% if x %}X{% endif now %}")
+
+    def test_dots_lookup_cache(self):
+        # Dotted lookups remember the types they have to index, but still
+        # give the same results as a full lookup.
+        class Named(AnyOldObject):
+            """A class with an attribute and also items."""
+            def __getitem__(self, key):
+                return "item"
+        lookup = DotsLookup('name')
+        self.assertEqual(lookup({'name': "dict"}), "dict")
+        self.assertEqual(lookup.indexed, [set([dict])])
+        self.assertEqual(lookup({'name': "again"}), "again")
+        self.assertEqual(lookup(Named(name="attribute")), "attribute")
+        self.assertEqual(lookup(Named()), "item")
+        self.assertEqual(lookup.indexed, [set([dict])])
+
+        # Attributes of an indexed type are still found first.
+        lookup = DotsLookup('keys')
+        self.assertEqual(sorted(lookup({'keys': 1})), ['keys'])
+
+    def test_loop_dots(self):
+        # The same lookup works on different kinds of values in a loop.
+        items = [{'a': 1}, AnyOldObject(a=2), {'a': 3}, AnyOldObject(a=lambda: 4)]
+        self.try_render(
+            "{% for item in items %}{{item.a}}{% endfor %}",
+            {'items': items},
+            "1234"
+            )
+
+    def test_strict(self):
+        class WithMemberFns(AnyOldObject):
+            """A class to try out member function access."""
+            def ditto(self):
+                """Return twice the .txt attribute."""
+                return self.txt + self.txt
+        obj = WithMemberFns(txt="Once", d={'a': "Ay"}, nums=[1, 2, 3])
+        template = Templite(
+            "{{obj.txt}} {{obj.ditto()}} {{obj.d[a]}} {{obj.nums[1]}}"
+            "{% for n in obj.nums %}{% if obj.d[a] %}{{n}}{% endif %}{% endfor %}"
+            "{{obj.txt|upper}}",
+            {'upper': lambda x: x.upper()},
+            strict=True,
+            )
+        self.assertEqual(
+            template.render({'obj': obj}), "Once OnceOnce Ay 2123ONCE"
+            )
+
+    def test_strict_access_is_direct(self):
+        # In strict mode, dots are only attributes, and items need brackets.
+        template = Templite("{{d.a}}", strict=True)
+        with self.assertRaises(AttributeError):
+            template.render({'d': {'a': 17}})
+        template = Templite("{{obj[a]}}", strict=True)
+        with self.assertRaises(TypeError):
+            template.render({'obj': AnyOldObject(a=17)})
+
+    def test_strict_syntax_errors(self):
+        with self.assertSynErr("Don't understand expression: 'a[b'"):
+            Templite("{{a[b}}", strict=True)
+        with self.assertSynErr("Not a valid attribute: '0'"):
+            Templite("{{a.0}}", strict=True)
+        with self.assertRaises(TypeError):
+            Templite("{{a}}", stric=True)
+
+    def test_render_iter(self):
+        # render_iter produces the same text as render, in chunks.
+        template = Templite(
+            "Look: {% for n in nums %}{{n}}, {% endfor %}done.",
+            {'nums': [1, 2, 3, 4]},
+            )
+        self.assertEqual(
+            "".join(template.render_iter()), "Look: 1, 2, 3, 4, done."
+            )
+        self.assertEqual(
+            list(template.render_iter(flush_size=4)),
+            ["Look: 1, 2, ", "3, 4, ", "done."]
+            )
+
+    def test_render_iter_nested_loops(self):
+        template = Templite(
+            "{% for n in nums %}"
+                "{% for a in abc %}{{a}}{{n}}{% endfor %};"
+            "{% endfor %}!"
+            )
+        chunks = list(template.render_iter(
+            {'nums': [0, 1], 'abc': ['a', 'b']}, flush_size=2
+            ))
+        self.assertEqual(chunks, ["a0", "b0", ";a1", "b1", ";!"])
+
+    def test_render_iter_empty(self):
+        self.assertEqual(list(Templite("").render_iter()), [])
+        self.assertEqual(
+            list(Templite("{% for n in nums %}{{n}}{% endfor %}").render_iter(
+                {'nums': []}
+                )),
+            []
+            )
+
+    def test_render_iter_is_lazy(self):
+        # Chunks are produced as the loop runs, not after it's finished.
+        def numbers():
+            for n in range(3):
+                yield n
+            raise AssertionError("Ran off the end")
+        template = Templite("{% for n in nums %}{{n}}{% endfor %}")
+        chunks = template.render_iter({'nums': numbers()}, flush_size=1)
+        self.assertEqual(next(chunks), "0")
+        self.assertEqual(next(chunks), "1")
+
+    def test_include(self):
+        loader = DictLoader({
+            'item.html': "<li>{{n}}{{punct}}</li>",
+            'list.html': "<ul>{% for n in nums %}{% include item.html %}{% endfor %}</ul>",
+            })
+        self.assertEqual(
+            Templite('{% include "list.html" %}!', loader=loader).render(
+                {'nums': [1, 2], 'punct': '.'}
+                ),
+            "<ul><li>1.</li><li>2.</li></ul>!"
+            )
+
+    def test_extends(self):
+        loader = DictLoader({
+            'base.html':
+                "<title>{% block title %}Default{% endblock %}</title>"
+                "{% block body %}<p>{% block greeting %}Hi{% endblock %}</p>"
+                "{% endblock %}",
+            'page.html':
+                "{% extends base.html %}"
+                "This is ignored."
+                "{% block greeting %}Hello, {{name}}{% endblock %}",
+            'special.html':
+                "{% extends page.html %}{% block title %}Special{% endblock %}",
+            })
+        self.assertEqual(
+            Templite("{% extends page.html %}", loader=loader).render(
+                {'name': 'Ned'}
+                ),
+            "<title>Default</title><p>Hello, Ned</p>"
+            )
+        self.assertEqual(
+            Templite("{% extends special.html %}", loader=loader).render(
+                {'name': 'Ned'}
+                ),
+            "<title>Special</title><p>Hello, Ned</p>"
+            )
+        self.assertEqual(
+            Templite(
+                "{% extends page.html %}{% block body %}Nothing{% endblock %}",
+                loader=loader,
+                ).render(),
+            "<title>Default</title>Nothing"
+            )
+
+    def test_empty_block_in_if(self):
+        loader = DictLoader({
+            'base.html': "{% if x %}{% block b %}X{% endblock %}{% endif %}!",
+            })
+        template = Templite(
+            "{% extends base.html %}{% block b %}{% endblock %}", loader=loader
+            )
+        self.assertEqual(template.render({'x': 1}), "!")
+
+    def test_dependencies(self):
+        loader = DictLoader({
+            'base.html': "{% block a %}{% include part.html %}{% endblock %}",
+            'part.html': "part",
+            })
+        template = Templite(
+            "{% extends base.html %}{% include part.html %}", loader=loader
+            )
+        self.assertEqual(template.dependencies, ['part.html', 'base.html'])
+
+    def test_include_errors(self):
+        loader = DictLoader({
+            'loop.html': "{% include loop.html %}",
+            'base.html': "{% block a %}{% endblock %}",
+            })
+        with self.assertSynErr("No loader to find template: 'other.html'"):
+            Templite("{% include other.html %}")
+        with self.assertSynErr("Template includes itself: 'loop.html'"):
+            Templite("{% include loop.html %}", loader=loader)
+        with self.assertSynErr("Don't understand include: '{% include %}'"):
+            Templite("{% include %}", loader=loader)
+        with self.assertSynErr(
+                "Extends must be the first tag: '{% extends base.html %}'"
+                ):
+            Templite("{% if x %}{% endif %}{% extends base.html %}", loader=loader)
+        with self.assertSynErr("Duplicate block: 'a'"):
+            Templite(
+                "{% extends base.html %}"
+                "{% block a %}{% endblock %}{% block a %}{% endblock %}",
+                loader=loader,
+                )
+        with self.assertSynErr("Don't understand block: '{% block %}'"):
+            Templite("{% block %}{% endblock %}")
+
+
+class DictLoader(object):
+    """A template loader with the template texts in a dict."""
+    def __init__(self, sources):
+        self.sources = sources
+
+    def get_source(self, name):
+        return self.sources[name]
+
+
+class TemplateLoaderTest(TestCase):
+    """Tests for TemplateLoader."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, "cache")
+        os.mkdir(self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_template(self, name, text, mtime=None):
+        """Write a template file, optionally with the given `mtime`."""
+        filename = os.path.join(self.directory, name)
+        with open(filename, "w") as f:
+            f.write(text)
+        if mtime is not None:
+            os.utime(filename, (mtime, mtime))
+
+    def no_compiling(self):
+        """Make compiling any template fail, to show that it's skipped."""
+        real_code_builder = templite.CodeBuilder
+        def restore():
+            templite.CodeBuilder = real_code_builder
+        self.addCleanup(restore)
+        def fail(*args):
+            raise AssertionError("Template was compiled")
+        templite.CodeBuilder = fail
+
+    def test_load(self):
+        self.write_template("hello.html", "Hello, {{name|upper}}!")
+        loader = TemplateLoader(self.directory)
+        template = loader.load("hello.html", {'upper': lambda x: x.upper()})
+        self.assertEqual(template.render({'name': 'Ned'}), "Hello, NED!")
+
+    def test_same_text_compiled_once(self):
+        self.write_template("one.html", "Hello, {{name}}!")
+        self.write_template("two.html", "Hello, {{name}}!")
+        loader = TemplateLoader(self.directory)
+        one = loader.load("one.html")
+        self.no_compiling()
+        two = loader.load("two.html")
+        three = loader.from_string("Hello, {{name}}!")
+        self.assertIs(one.code, two.code)
+        self.assertEqual(three.render({'name': 'Ben'}), "Hello, Ben!")
+
+    def test_from_string(self):
+        loader = TemplateLoader(self.directory)
+        first = loader.from_string("{{a}}-{{b}}", {'a': 1})
+        second = loader.from_string("{{a}}-{{b}}", {'a': 2})
+        self.assertIs(first.code, second.code)
+        self.assertEqual(first.render({'b': 3}), "1-3")
+        self.assertEqual(second.render({'b': 3}), "2-3")
+
+    def test_disk_cache(self):
+        self.write_template("loop.html", "{% for n in nums %}{{n}},{% endfor %}")
+        TemplateLoader(self.directory, self.cache_dir).load("loop.html")
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        # A new loader, as in a new process, reads the compiled code instead.
+        self.no_compiling()
+        loader = TemplateLoader(self.directory, self.cache_dir)
+        template = loader.load("loop.html")
+        self.assertEqual(template.render({'nums': [1, 2, 3]}), "1,2,3,")
+
+    def test_disk_cache_invalidated_by_mtime(self):
+        self.write_template("page.html", "Old {{x}}", mtime=1000000000)
+        TemplateLoader(self.directory, self.cache_dir).load("page.html")
+        self.write_template("page.html", "New {{x}}", mtime=1000000100)
+        template = TemplateLoader(self.directory, self.cache_dir).load("page.html")
+        self.assertEqual(template.render({'x': 1}), "New 1")
+
+    def test_options(self):
+        # Strict and non-strict versions of a template are cached separately.
+        self.write_template("page.html", "{{d.a}}")
+        loader = TemplateLoader(self.directory, self.cache_dir)
+        self.assertEqual(loader.load("page.html").render({'d': {'a': 1}}), "1")
+        strict = loader.load("page.html", strict=True)
+        with self.assertRaises(AttributeError):
+            strict.render({'d': {'a': 1}})
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def test_changed_dependency(self):
+        # Code is recompiled when a template it includes changes.
+        self.write_template("part.html", "old", mtime=1000000000)
+        self.write_template("page.html", "[{% include part.html %}]")
+        loader = TemplateLoader(self.directory, self.cache_dir)
+        self.assertEqual(loader.load("page.html").render(), "[old]")
+        self.write_template("part.html", "new", mtime=1000000100)
+        self.assertEqual(loader.load("page.html").render(), "[new]")
+        self.write_template("part.html", "newer", mtime=1000000200)
+        loader = TemplateLoader(self.directory, self.cache_dir)
+        self.assertEqual(loader.load("page.html").render(), "[newer]")
+
+    def test_bad_cache_file_ignored(self):
+        self.write_template("page.html", "Hi {{x}}")
+        TemplateLoader(self.directory, self.cache_dir).load("page.html")
+        cache_file = os.path.join(self.cache_dir, os.listdir(self.cache_dir)[0])
+        with open(cache_file, "wb") as f:
+            f.write(b"garbage")
+        template = TemplateLoader(self.directory, self.cache_dir).load("page.html")
+        self.assertEqual(template.render({'x': 1}), "Hi 1")